@@ -3,41 +3,1251 @@
 """Overview:
     telnet/ssh client with continuous command execution and automatic log saving function by Python3.
 Usage:
-    pyTelnetCmdExec.py <cmdlist_file> [--log_dir <logdir_path>] [--disable_log] [-h|--help]
+    pyTelnetCmdExec.py <cmdlist_file> [--engine <engine>] [--log_dir <logdir_path>] [--disable_log] [--compress <method>] [--raw_log] [--plan_cache <cache_dir>] [--prompt_cache <cache_dir>] [--prompt_cache_ttl <sec>] [--connect_timeout <sec>] [--retries <num>] [--metrics] [--metrics_prom <prom_file>] [--store <db_file>] [--diff] [--quiet] [-h|--help]
+    pyTelnetCmdExec.py --fleet <fleet_target> [--inventory <inventory_file>] [--workers <num>] [--per_host <num>] [--processes <num>] [--engine <engine>] [--log_dir <logdir_path>] [--disable_log] [--compress <method>] [--raw_log] [--plan_cache <cache_dir>] [--prompt_cache <cache_dir>] [--prompt_cache_ttl <sec>] [--ssh_pool_ttl <sec>] [--connect_timeout <sec>] [--retries <num>] [--metrics] [--metrics_prom <prom_file>] [--store <db_file>] [--diff] [--quiet]
+    pyTelnetCmdExec.py --store <db_file> --latest <command>
 
 Options:
     --log_dir <logdir_path>  : Specify the log output destination directory.(default="./log/")
     --disable_log            : Do not output log file.
+    --compress <method>      : Compress log file with "gzip" or "xz".
+    --raw_log                : Write the received bytes to log file without decoding.(CR is removed)
+    --plan_cache <cache_dir> : Cache the parsed command list files in <cache_dir>.
+                               The cache is used while the command list file is not changed.
+    --prompt_cache <cache_dir>
+                             : Cache the prompts and the platform learned from each host in <cache_dir>.
+                               Only the cached prompts are accepted after login, and the platform is not detected again.
+    --prompt_cache_ttl <sec> : Learn the prompts and the platform again after <sec> seconds.(default=86400)
+    --metrics                : Write the timing of the session to "*.metrics.jsonl" next to the log file.
+    --metrics_prom <prom_file>
+                             : Write the timing of the sessions as a Prometheus text file.
+    --store <db_file>        : Append the output of each command to the SQLite database <db_file>.
+    --latest <command>       : Show the latest output of <command> for each host in <db_file>.
+    --diff                   : Compare the output of each command with the previous run in --store,
+                               and keep only the changed output in the log file.
+    --quiet                  : Do not echo the output of sessions to stdout.
+    --fleet <fleet_target>   : Execute many command list files concurrently.
+                               <fleet_target> is a directory(*.txt), a glob pattern, or a manifest file
+                               that lists one command list file per line.
+    --inventory <inventory_file>
+                             : Execute the command list file <fleet_target> on every target of <inventory_file>.(CSV or YAML)
+                               The ipaddr, port, username, password and alt_addr columns override the first line,
+                               and "{{column}}" in the commands and the expect responses is replaced with the value of the target.
+    --workers <num>          : Maximum number of concurrent sessions in fleet mode.(default=8)
+    --per_host <num>         : Maximum number of concurrent sessions per host in fleet mode.(default=1)
+    --processes <num>        : Split the hosts of the fleet across <num> processes, and each process runs
+                               its own sessions with <workers>/<num> workers.(default=1, 0=number of CPUs)
+    --ssh_pool_ttl <sec>     : Reuse SSH connections to the same host and user in fleet mode,
+                               and close them after <sec> seconds idle.(default=60, 0=disable)
+    --connect_timeout <sec>  : Timeout of the TCP connection to a device.(default=2)
+    --retries <num>          : Retry the failed TCP connection with exponential backoff.(default=2)
+                               After 3 sessions of a host failed to connect, the host is skipped for 60 seconds.
+    --engine <engine>        : Session engine, "thread" or "asyncio".(default="thread")
+                               "asyncio" runs all sessions in one event loop.(ssh requires asyncssh)
     -h, --help               : Show this help message and exit.
 """
 
+import asyncio
+import codecs
+import collections
+import concurrent.futures
+import copy
+import csv
 import datetime
+import difflib
 import docopt
+import errno
+import glob
+import gzip
+import hashlib
+import json
+import lzma
+import math
 import os
 import paramiko
+import queue
+import random
 import re
+import selectors
+import socket
+import sqlite3
 import sys
 import telnetlib
+import threading
 import time
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Tuple
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Echo the output of sessions to stdout.(disabled by --quiet)
+echo_console = True
+
+# Pool of SSH connections shared by sessions.(set by --fleet)
+ssh_pool = None
+
+# Retry and circuit breaker of TCP connections shared by sessions.(set by main)
+connection_manager = None
+
+# Prompts and platforms learned from the hosts.(set by --prompt_cache)
+prompt_cache = None
+
+# "{{name}}" in the commands.(--inventory)
+variable_pattern = re.compile("\\{\\{\\s*(\\w+)\\s*\\}\\}")
+
+# Set of standby prompt characters
+standby_prompts = [b">$", b"> $", b"#$", b"# $", b"\\$$", b"\\$ $", b"%$", b"% $", b"[Pp]assword: $", b"login: $", b"name: $"]
 
 class ConnectionInformation:
-    def __init__(self, ipaddr, port, username, passwd, timeout):
+    def __init__(self, ipaddr, port, username, passwd, timeout, encoding="", ssh_mode="shell", parallel=1, platform="auto", pager_window=0, pipeline=1, alt_addrs=[]):
         self.ipaddr = ipaddr
         self.port = port
         self.username = username
         self.passwd = passwd
         self.timeout = timeout
+        self.encoding = encoding
+        self.ssh_mode = ssh_mode
+        self.parallel = parallel
+        self.platform = platform
+        self.pager_window = pager_window
+        self.pipeline = pipeline
+        # Other addresses of the device, raced with ipaddr.
+        self.alt_addrs = alt_addrs
+
+class StreamDecoder:
+    """
+    Incremental decoder of the output of a session.
+
+    The encoding is given by the command list, or detected once from the first
+    non-ASCII output(such as the banner). After that every byte is decoded exactly
+    once, and multibyte characters split across chunks are not lost.
+    """
+    candidate_encodings = ["utf8", "sjis"]
+
+    def __init__(self, encoding: str = ""):
+        self.encoding = ""
+        self.decoder = None
+        if encoding != "":
+            self.set_encoding(encoding)
+
+    def set_encoding(self, encoding: str):
+        self.encoding = codecs.lookup(encoding).name
+        self.decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+
+    def detect_encoding(self, current_output: bytes) -> str:
+        for enc in self.candidate_encodings:
+            try:
+                codecs.getincrementaldecoder(enc)().decode(current_output, final=False)
+                return enc
+            except UnicodeDecodeError:
+                continue
+        return self.candidate_encodings[0]
+
+    def decode(self, current_output: bytes) -> str:
+        """
+        bytes to str
+        """
+        if self.decoder is None:
+            if current_output.isascii():
+                return current_output.decode("ascii")
+            self.set_encoding(self.detect_encoding(current_output))
+        return self.decoder.decode(current_output)
+
+    def decode_tail(self, current_output: bytes, max_bytes: int = 2048) -> str:
+        """
+        Decode only the last line of the output.(for prompt detection of the raw log)
+
+        A newline byte never appears inside a multibyte character of UTF-8 or Shift_JIS,
+        so decoding can restart from the last newline.
+        """
+        pos = current_output.rfind(b"\n")
+        if pos < 0 and len(current_output) <= max_bytes:
+            return self.decode(current_output)
+        if self.decoder is not None:
+            self.decoder.reset()
+        return "\n" + self.decode(current_output[max(pos + 1, len(current_output) - max_bytes):])
+
+class CmdlistPlan:
+    """
+    Parsed command list file.
+
+    commands is a list of (command line, inline directives),
+    the comment section is already deleted from the command line.
+    The expect rules of a command are [[regex, response], ...] in its directives["expect"].
+    """
+    version = 7
+    comment_pattern = re.compile("#.*|//.*")
+    expect_pattern = re.compile("^#@(expect|respond)\\s+(.+?)\\s+send(?:\\s+(.*))?$")
+
+    def __init__(self, filename, ipaddr, port, username, passwd, encoding, commands, ssh_mode="shell", parallel=1, platform="auto", pager_window=0, pipeline=1, alt_addrs=[]):
+        self.filename = filename
+        self.ipaddr = ipaddr
+        self.port = port
+        self.username = username
+        self.passwd = passwd
+        self.encoding = encoding
+        self.commands = commands
+        self.ssh_mode = ssh_mode
+        self.parallel = parallel
+        self.platform = platform
+        self.pager_window = pager_window
+        self.pipeline = pipeline
+        self.alt_addrs = alt_addrs
+        # Values of the target substituted into the commands.(set by --inventory)
+        self.variables = {}
+
+    def connection_information(self, timeout) -> ConnectionInformation:
+        return ConnectionInformation(self.ipaddr, self.port, self.username, self.passwd, timeout, self.encoding, self.ssh_mode, self.parallel,
+                                     self.platform, self.pager_window, self.pipeline, self.alt_addrs)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"ipaddr": self.ipaddr, "port": self.port, "username": self.username, "passwd": self.passwd,
+                "encoding": self.encoding, "commands": self.commands, "ssh_mode": self.ssh_mode, "parallel": self.parallel,
+                "platform": self.platform, "pager_window": self.pager_window, "pipeline": self.pipeline,
+                "alt_addrs": self.alt_addrs}
+
+    @staticmethod
+    def from_dict(filename: str, d: Dict[str, object]):
+        commands = [(line, options) for line, options in d["commands"]]
+        return CmdlistPlan(filename, d["ipaddr"], d["port"], d["username"], d["passwd"], d["encoding"], commands, d["ssh_mode"], d["parallel"],
+                           d["platform"], d["pager_window"], d["pipeline"], d["alt_addrs"])
+
+class OutputInformation:
+    def __init__(self, disable_log_output, logdir_path, compress, raw_log=False, metrics=False, store="", diff=False, callback=None):
+        self.disable_log_output = disable_log_output
+        self.logdir_path = logdir_path
+        self.compress = compress
+        self.raw_log = raw_log
+        self.metrics = metrics
+        self.store = store
+        self.diff = diff
+        # Function that receives the decoded output instead of the log file.
+        self.callback = callback
+        # SessionMetrics of all sessions.(None unless --metrics_prom)
+        self.metrics_sessions = None
+
+def open_log_file(filename: str, compress: str, mode: str) -> object:
+    """
+    Open the log file.(gzip or xz if compress)
+    """
+    if compress == "gzip":
+        return gzip.open(filename, mode)
+    if compress == "xz":
+        return lzma.open(filename, mode)
+    return open(filename, mode)
+
+class LogWriter:
+    """
+    Buffered log file writer.
+
+    The output is accumulated in a byte buffer, and written in large blocks
+    by one background writer thread shared by all sessions.
+
+    If sections is a list, the output is also split at the command boundaries.(for --store)
+    Each section has the command, the time, and the offset and size in the log file(before compression),
+    the output is read back from the log file after it is closed.(see read_log_sections())
+    """
+    writer_queue = None
+    writer_lock = threading.Lock()
+
+    def __init__(self, filename: str, string_remove: str = "", compress: str = "", buffer_size: int = 65536, raw: bool = False, encoding: str = "utf-8"):
+        self.f = open_log_file(filename, compress, "wb")
+        self.filename = filename
+        self.compress = compress
+        self.string_remove = string_remove.encode()
+        self.raw = raw
+        self.encoding = encoding
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+        # If False, write_bytes() never waits for the writer thread.(asyncio engine, see drain_log_writer())
+        self.blocking = True
+        self.closed_event = threading.Event()
+        self.offset = 0
+        self.sections = None
+        self.section = None
+
+        with LogWriter.writer_lock:
+            if LogWriter.writer_queue is None:
+                # The queue is bounded, so that slow storage throttles the sessions.
+                LogWriter.writer_queue = queue.Queue(maxsize=1024)
+                threading.Thread(target=LogWriter.writer_thread, daemon=True).start()
+
+    @staticmethod
+    def writer_thread():
+        while True:
+            wf, data = LogWriter.writer_queue.get()
+            try:
+                if data is None:
+                    wf.f.close()
+                else:
+                    if len(wf.string_remove) > 0:
+                        data = data.translate(None, wf.string_remove)
+                    if os.linesep != "\n" and not wf.raw:
+                        data = data.replace(b"\n", os.linesep.encode())
+                    wf.f.write(data)
+            except Exception as e:
+                print("\n{0}".format(e))
+            finally:
+                if data is None:
+                    wf.closed_event.set()
+
+    def write(self, outputString: str):
+        self.write_bytes(outputString.encode(self.encoding, errors="replace"))
+
+    def write_bytes(self, current_output: bytes):
+        self.buffer += current_output
+        if self.sections is not None:
+            self.offset += self.get_file_size(current_output)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush(self.blocking)
+
+    def get_file_size(self, data: bytes) -> int:
+        """
+        Size of data in the log file.(same as the writer thread does)
+        """
+        size = len(data)
+        for c in self.string_remove:
+            size -= data.count(c)
+        if os.linesep != "\n" and not self.raw and b"\n" not in self.string_remove:
+            size += data.count(b"\n") * (len(os.linesep) - 1)
+        return size
+
+    def begin_section(self, line: str, tail: str = ""):
+        """
+        The section begins before the last tail characters already written.
+        """
+        if self.sections is None:
+            return
+        self.end_section("")
+        data = tail.encode(self.encoding, errors="replace")
+        self.section = {"command": line, "time": time.time(), "offset": self.offset - self.get_file_size(data)}
+
+    def end_section(self, completion: str, tail: str = ""):
+        """
+        The section ends before the last tail characters already written.
+        """
+        if self.section is None:
+            return
+        section, self.section = self.section, None
+        data = tail.encode(self.encoding, errors="replace")
+        section["size"] = max(self.offset - self.get_file_size(data) - section["offset"], 0)
+        section["completion"] = completion
+        self.sections.append(section)
+
+    def flush(self, block: bool = True):
+        if len(self.buffer) > 0:
+            try:
+                LogWriter.writer_queue.put((self, bytes(self.buffer)), block)
+            except queue.Full:
+                # Keep the buffer until the queue has room.
+                return
+            self.buffer = bytearray()
+
+    def close(self):
+        """
+        Flush the buffer, and wait until the log file is closed.
+        """
+        self.flush()
+        LogWriter.writer_queue.put((self, None))
+        self.closed_event.wait()
+
+class CallbackWriter:
+    """
+    Log writer that passes the decoded output to a callback instead of a file.
+    """
+    raw = False
+    sections = None
+
+    def __init__(self, callback: object):
+        self.callback = callback
+        self.filename = ""
+
+    def write(self, outputString: str):
+        self.callback(outputString)
+
+    def begin_section(self, line: str, tail: str = ""):
+        pass
+
+    def end_section(self, completion: str, tail: str = ""):
+        pass
+
+    def close(self):
+        pass
+
+class OutputLog(collections.deque):
+    """
+    Output of the login, kept until the log file is opened.
+
+    Only the last max_size characters are kept, so that a device that never shows
+    the prompt does not grow the memory.
+    """
+    def __init__(self, max_size=1048576):
+        super().__init__()
+        self.max_size = max_size
+        self.size = 0
+
+    def append(self, outputString: str):
+        super().append(outputString)
+        self.size += len(outputString)
+        while self.size > self.max_size and len(self) > 1:
+            self.size -= len(self.popleft())
+
+class AdaptiveIdleTimeout:
+    """
+    Idle timeout that adapts to the observed response time of the device.
+
+    The timeout is estimated like the TCP retransmission timer(RFC 6298),
+    timeout = srtt + 4 * rttvar, and doubles every time it expires without output.
+    The prompt is the completion of a command, so the estimate only raises the timeout
+    for slow devices, and never lowers it below the fixed 2 seconds.(minimum)
+    """
+    def __init__(self, initial=2.0, minimum=2.0, maximum=30.0):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+
+    def observe(self, response_time: float):
+        if self.srtt is None:
+            self.srtt = response_time
+            self.rttvar = response_time / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - response_time)
+            self.srtt = 0.875 * self.srtt + 0.125 * response_time
+        self.backoff = 1
+
+    def expired(self):
+        self.backoff = min(self.backoff * 2, 64)
+
+    def get_timeout(self) -> float:
+        if self.srtt is None:
+            timeout = self.initial
+        else:
+            timeout = min(max(self.srtt + 4 * self.rttvar, self.minimum), self.maximum)
+        return min(timeout * self.backoff, self.maximum)
+
+class PromptMatcher:
+    """
+    Streaming matcher of the last line of the output.
+
+    Only a bounded tail of the last line is kept. The prompt candidate strings
+    are matched with one set lookup, and the other prompts with one combined
+    precompiled regular expression, so every chunk is processed in O(chunk).
+    """
+    NONE = 0
+    PROMPT = 1
+    PASSWORD = 2
+    CONFIRM = 3
+    PAGER = 4
+    RESPOND = 5
+
+    other_prompt_pattern = re.compile("(?P<password>[Pp]assword: )|(?P<confirm>\\]: $)|(?P<pager>--[Mm]ore--|--続きます--|--続ける--|---\\(more( \\d+%)?\\)---|---- More ----)")
+    other_prompt_events = {"password": PASSWORD, "confirm": CONFIRM, "pager": PAGER}
+    # Completion of the command for SessionMetrics.(NONE means the session is closed)
+    event_names = {NONE: "eof", PROMPT: "prompt", PASSWORD: "password", CONFIRM: "confirm", PAGER: "pager", RESPOND: "respond"}
+
+    def __init__(self, prompt_list: List[str], max_tail=512):
+        # Trailing spaces are ignored, because pager responses sent ahead may be echoed after the prompt.
+        self.prompts = set([_.rstrip(" ") for _ in prompt_list])
+        self.max_tail = max_tail
+        self.tail = ""
+        self.truncated = False
+        # Expect rules of the current command, and the response of the matched rule.
+        self.rules = []
+        self.response = None
+
+    def set_rules(self, rules: List[Tuple[str, str]]):
+        """
+        Set the expect rules of the command.(list of (regex, response))
+        """
+        self.rules = [(re.compile(pattern), response) for pattern, response in rules]
+
+    def reset(self):
+        self.tail = ""
+        self.truncated = False
+
+    def feed(self, decoded_current_output: str) -> int:
+        """
+        Append the received output, and return the event of the last line.
+        """
+        pos = decoded_current_output.rfind("\n")
+        if pos >= 0:
+            self.tail = decoded_current_output[pos + 1:]
+            self.truncated = False
+        else:
+            self.tail += decoded_current_output
+        if len(self.tail) > self.max_tail:
+            # A prompt never matches such a long line.
+            self.tail = self.tail[-self.max_tail:]
+            self.truncated = True
+
+        if len(self.tail) == 0:
+            return self.NONE
+        if not self.truncated and self.tail.rstrip(" ") in self.prompts:
+            return self.PROMPT
+        # The expect rules take precedence over the built-in prompts.
+        for pattern, response in self.rules:
+            if pattern.search(self.tail):
+                self.response = response
+                return self.RESPOND
+        m = self.other_prompt_pattern.search(self.tail)
+        if m is None:
+            return self.NONE
+        return self.other_prompt_events[m.lastgroup]
+
+class PlatformProfile:
+    """
+    Pager handling of a platform.
+
+    The platform is detected by banner_pattern from the login output,
+    or by prompt_pattern from the prompt. pager_off_commands are sent after login.
+    Where paging cannot be disabled, pager_window responses are sent at the first pager prompt
+    of a command, so that the device does not wait a round trip for each page.
+    If paging is False, the platform never shows the pager prompt.
+    """
+    def __init__(self, name, banner_pattern, prompt_pattern, pager_off_commands, pager_window=1, paging=True):
+        self.name = name
+        self.banner_pattern = re.compile(banner_pattern) if banner_pattern else None
+        self.prompt_pattern = re.compile(prompt_pattern) if prompt_pattern else None
+        self.pager_off_commands = pager_off_commands
+        self.pager_window = pager_window
+        self.paging = paging
+
+# Platform profiles in the order of detection.
+platform_profiles = [
+    PlatformProfile("cisco_nxos", "Cisco Nexus Operating System|NX-OS", None, ["terminal length 0"]),
+    PlatformProfile("cisco_asa", "Adaptive Security Appliance", None, ["terminal pager 0"]),
+    PlatformProfile("arista_eos", "Arista", None, ["terminal length 0"]),
+    PlatformProfile("junos", "JUNOS|Juniper", "^[\\w.\\-]+@[\\w.\\-]+[>#] ?$", ["set cli screen-length 0"]),
+    PlatformProfile("huawei_vrp", "Huawei|HUAWEI", "^[<\\[][\\w.\\-]+[>\\]]$", ["screen-length 0 temporary"]),
+    PlatformProfile("hp_procurve", "ProCurve|Hewlett-Packard", None, ["no page"]),
+    PlatformProfile("fortios", "FortiGate", None, [], pager_window=4),
+    PlatformProfile("cisco_ios", "User Access Verification|Cisco IOS", "^[\\w.\\-]+(\\([\\w.\\-]+\\))?[>#] ?$", ["terminal length 0"]),
+    PlatformProfile("linux", "Linux|Ubuntu|GNU", "^[\\w.\\-]+@[\\w.\\-]+:.*[$#] ?$", [], paging=False),
+]
+
+class PromptCache:
+    """
+    Prompts and platform learned from the hosts.
+
+    One JSON file is kept for each host, port and username.
+    The entry expires ttl seconds after it was learned,
+    and it is learned again when the host shows another prompt.
+    """
+    version = 1
+
+    def __init__(self, cache_dir: str, ttl: float = 86400.0):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def get_filename(self, cn: ConnectionInformation) -> str:
+        key = "{0}:{1}:{2}".format(cn.ipaddr, cn.port, cn.username)
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def load(self, cn: ConnectionInformation) -> Dict[str, object]:
+        """
+        Return {"prompt_list": [...], "platform": name, "time": learned time}, or None.
+        platform is the name of PlatformProfile, "none", or "auto" if it was not detected.
+        """
+        try:
+            with open(self.get_filename(cn), "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry["version"] != self.version or entry["time"] + self.ttl < time.time():
+                return None
+            if len(entry["prompt_list"]) == 0:
+                return None
+            return entry
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, cn: ConnectionInformation, prompt_list: List[str], platform: str):
+        entry = {"version": self.version, "time": time.time(), "prompt_list": prompt_list, "platform": platform}
+        filename = self.get_filename(cn)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_filename = "{0}.{1}.{2}.tmp".format(filename, os.getpid(), threading.get_ident())
+            with open(tmp_filename, "wt", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_filename, filename)
+        except OSError:
+            pass
+
+class SessionMetrics:
+    """
+    Timing of one session.
+
+    connect_time    ... seconds until the connection is established.
+    login_time      ... seconds from the connection until the prompt is detected.
+    And for each command,
+    first_byte_time ... seconds from sending the command until the first output.
+    prompt_time     ... seconds from sending the command until the completion.
+    completion      ... "prompt", "password", "confirm", "eof", or "timeout" when the idle fallback was used.
+    """
+    def __init__(self, cn: ConnectionInformation, enabled: bool):
+        self.enabled = enabled
+        self.ipaddr = cn.ipaddr
+        self.port = cn.port
+        self.start_time = time.time()
+        self.connect_time = None
+        self.login_time = None
+        self.commands = []
+        self.current = None
+
+    def connected(self):
+        if self.enabled:
+            self.connect_time = time.time() - self.start_time
+
+    def logged_in(self):
+        if self.enabled:
+            self.login_time = time.time() - self.start_time - (self.connect_time or 0.0)
+
+    def command_sent(self, line: str):
+        if self.enabled:
+            self.current = {"command": line, "send_time": time.time(), "first_byte_time": None, "bytes": 0, "pages": 0, "fallbacks": 0}
+
+    def received(self, size: int):
+        if self.enabled and self.current is not None:
+            if self.current["first_byte_time"] is None:
+                self.current["first_byte_time"] = time.time() - self.current["send_time"]
+            self.current["bytes"] += size
+
+    def page(self):
+        if self.enabled and self.current is not None:
+            self.current["pages"] += 1
+
+    def fallback(self):
+        if self.enabled and self.current is not None:
+            self.current["fallbacks"] += 1
+
+    def command_done(self, completion: str):
+        if self.enabled and self.current is not None:
+            if self.current["fallbacks"] > 0:
+                completion = "timeout"
+            self.add_command(self.current["command"], self.current["send_time"], self.current["first_byte_time"], time.time() - self.current["send_time"],
+                             self.current["bytes"], self.current["pages"], completion)
+            self.current = None
+
+    def add_command(self, line: str, send_time: float, first_byte_time: float, prompt_time: float, size: int, pages: int, completion: str):
+        if self.enabled:
+            self.commands.append({"command": line, "send_time": send_time, "first_byte_time": first_byte_time, "prompt_time": prompt_time,
+                                  "bytes": size, "pages": pages, "completion": completion})
+
+    def write(self, filename: str):
+        """
+        Write the metrics as JSONL.(the first line is the session, and the others are the commands)
+        """
+        with open(filename, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"type": "session", "ipaddr": self.ipaddr, "port": self.port, "start_time": self.start_time,
+                                "connect_time": self.connect_time, "login_time": self.login_time, "commands": len(self.commands)}) + "\n")
+            for command in self.commands:
+                f.write(json.dumps(dict(type="command", **command)) + "\n")
+
+class CommandStep:
+    """
+    One command executed until the prompt, without the I/O.(shared by the thread and asyncio engines)
+
+    Send begin(), and pass each received chunk to received() and feed(), that returns the answer to send.
+    If nothing is received until get_deadline(), send expired().(the newline of the idle fallback)
+    The command is finished when done is True or the stream is closed, then call finish().
+    """
+    def __init__(self, line: str, options: Dict[str, str], prompt_matcher: PromptMatcher, idle_timeout: AdaptiveIdleTimeout, pager_window: int,
+                 metrics: SessionMetrics, wf: object, previous_completion: str = None):
+        self.line = line
+        self.options = options
+        self.prompt_matcher = prompt_matcher
+        self.idle_timeout = idle_timeout
+        self.pager_window = pager_window
+        self.metrics = metrics
+        self.wf = wf
+        self.label = get_command_label(line, previous_completion)
+        self.pages = 0
+        self.completion = "eof"
+        self.done = False
+        self.send_time = None
+        self.last_receive_time = None
+
+    def begin(self) -> bytes:
+        """
+        Return the command to send.
+        """
+        self.metrics.command_sent(self.label)
+        if self.wf is not None:
+            self.wf.begin_section(self.label)
+        self.prompt_matcher.reset()
+        self.prompt_matcher.set_rules(self.options.get("expect", []))
+
+        # set command execution start time.
+        self.send_time = time.time()
+        self.last_receive_time = self.send_time
+        return self.line.encode() + b"\n"
+
+    def get_deadline(self) -> float:
+        return get_command_deadline(self.idle_timeout, self.options, self.send_time, self.last_receive_time)
+
+    def expired(self) -> bytes:
+        """
+        If no prompt was found until the deadline, send a newline to go to the next command.
+        """
+        self.idle_timeout.expired()
+        self.metrics.fallback()
+        self.last_receive_time = time.time()
+        return b"\r\n"
+
+    def received(self, size: int):
+        now = time.time()
+        self.idle_timeout.observe(now - self.last_receive_time)
+        self.last_receive_time = now
+        self.metrics.received(size)
+
+    def feed(self, decoded_current_output: str) -> bytes:
+        """
+        Match the output, and return the answer to send.
+        """
+        event = self.prompt_matcher.feed(decoded_current_output)
+        self.completion = PromptMatcher.event_names[event]
+
+        if event == PromptMatcher.PROMPT:
+            # If it matches any of the prompt candidate strings.
+            self.done = True
+
+        if event == PromptMatcher.PASSWORD or event == PromptMatcher.CONFIRM:
+            """
+            match "[Pp]assword: " or "]: $"
+
+            Example1)
+            last line ... "How many bits in the modulus [512]: "
+
+            Example2)
+            last line ... "% Do you really want to replace them? [yes/no]: "
+            """
+            self.done = True
+
+        if event == PromptMatcher.RESPOND:
+            """
+            answer the prompt matched by the expect rule at once, instead of the idle fallback.
+            """
+            sendBytes = self.prompt_matcher.response.encode() + b"\n"
+            self.prompt_matcher.reset()
+            self.last_receive_time = time.time()
+            return sendBytes
+
+        if event == PromptMatcher.PAGER:
+            """
+            repeat send space for "--More--".(pager_window spaces at the first page)
+            """
+            sendBytes = b" " * (self.pager_window if self.pages == 0 else 1)
+            self.pages += 1
+            self.metrics.page()
+            self.prompt_matcher.reset()
+            self.last_receive_time = time.time()
+            return sendBytes
+        return b""
+
+    def finish(self) -> str:
+        """
+        Close the section and the metrics of the command, and return the completion.
+        """
+        self.metrics.command_done(self.completion)
+        if self.wf is not None:
+            self.wf.end_section(self.completion)
+        return self.completion
+
+class CommandPipeline:
+    """
+    Commands sent ahead without waiting for the prompt.(for devices that buffer input)
+
+    Up to window commands are in flight. A line of the output that starts with the prompt
+    is paired with the command echoed after the prompt, and completes the commands in flight
+    before that command.(the oldest one, if the echo is not one of them)
+    A password or confirm prompt at the end of the output completes the oldest command.
+    So the output is split per command, and the next commands are sent.
+
+    A command that may ask something(asking_pattern, or with expect rules), and the answer
+    after a password or confirm prompt, are sent alone, and wait for their prompt.
+    The pager prompt must be disabled, because the commands sent ahead would answer it.
+    """
+    # Commands that may ask a password or a confirmation.
+    asking_pattern = re.compile("^\\s*(en(a(b(le?)?)?)?|su|sudo|login|reload|copy|wr(ite)?|erase|del(ete)?|clear)(\\s|$)")
+
+    def __init__(self, commands: List[Tuple[str, Dict[str, str]]], prompt_list: List[str], window: int, pager_window: int, metrics: SessionMetrics, wf: object,
+                 max_line=512):
+        self.pending = collections.deque(skip_blank_commands(commands))
+        self.inflight = collections.deque()
+        self.prompts = tuple(set([_.rstrip(" ") for _ in prompt_list]))
+        # The rules of all commands("#@respond") do not make a command asking.
+        rule_sets = [set([tuple(_) for _ in options.get("expect", [])]) for _, options in self.pending]
+        self.common_rules = set.intersection(*rule_sets) if len(rule_sets) > 0 else set()
+        self.window = window
+        self.pager_window = pager_window
+        self.metrics = metrics
+        self.wf = wf
+        self.max_line = max_line
+        # The last line of the output, and whether it is already counted as a prompt.
+        self.line = ""
+        self.counted = False
+        # The next command answers a password or confirm prompt.
+        self.answer_next = False
+        self.last_completion = None
+
+    def done(self) -> bool:
+        return len(self.pending) == 0 and len(self.inflight) == 0
+
+    def send_ahead(self) -> str:
+        """
+        Return the commands to send, up to window commands in flight.
+        """
+        sendString = ""
+        now = time.time()
+        while len(self.pending) > 0 and len(self.inflight) < self.window:
+            line, options = self.pending.popleft()
+            alone = self.answer_next or self.asking_pattern.match(line) is not None or any([tuple(_) not in self.common_rules for _ in options.get("expect", [])])
+            if len(self.inflight) > 0 and (alone or any([_["alone"] for _ in self.inflight])):
+                self.pending.appendleft((line, options))
+                break
+            label = get_command_label(line, self.last_completion if self.answer_next else None)
+            self.answer_next = False
+            self.inflight.append({"command": line, "label": label, "options": options, "send_time": now, "first_byte_time": None, "bytes": 0, "pages": 0, "fallbacks": 0,
+                                  "alone": alone, "rules": [(re.compile(pattern), response) for pattern, response in options.get("expect", [])]})
+            if len(self.inflight) == 1 and self.wf is not None:
+                self.wf.begin_section(label)
+            sendString += line + "\n"
+        return sendString
+
+    def get_deadline(self, idle_timeout: AdaptiveIdleTimeout, last_receive_time: float) -> float:
+        """
+        Time when the idle fallback sends a newline for the oldest command in flight.
+        """
+        entry = self.inflight[0]
+        return get_command_deadline(idle_timeout, entry["options"], entry["send_time"], last_receive_time)
+
+    def expired(self) -> str:
+        """
+        Return a newline for the idle fallback. Its prompt is waited for as a command without a name.
+        """
+        self.inflight[0]["fallbacks"] += 1
+        self.inflight.append({"command": None, "options": {}, "send_time": time.time(), "first_byte_time": None, "bytes": 0, "pages": 0, "fallbacks": 0,
+                              "alone": False, "rules": []})
+        return "\r\n"
+
+    def feed(self, decoded_current_output: str, size: int) -> str:
+        """
+        Split the received output at the prompts, and return the string to send.
+
+        The output sections are split before the output after each prompt.(the tail of the chunk)
+        """
+        if len(self.inflight) > 0:
+            entry = self.inflight[0]
+            if entry["first_byte_time"] is None:
+                entry["first_byte_time"] = time.time() - entry["send_time"]
+            entry["bytes"] += size
+
+        lines = decoded_current_output.split("\n")
+        # Position of self.line in decoded_current_output.
+        position = -len(self.line)
+        self.line = (self.line + lines[0])[:self.max_line]
+        next_position = len(lines[0]) + 1
+        for next_line in lines[1:]:
+            if not self.counted and self.line.lstrip("\r").startswith(self.prompts):
+                prompt_end = self.get_prompt_end(self.line)
+                for _ in range(self.get_completed_count(self.line[prompt_end:].strip())):
+                    self.complete("prompt", decoded_current_output[max(position + prompt_end, 0):])
+            position = next_position
+            next_position += len(next_line) + 1
+            self.line = next_line[:self.max_line]
+            self.counted = False
+
+        sendString = ""
+        if not self.counted and self.line.rstrip(" ") in self.prompts:
+            if len(self.inflight) > 0:
+                self.complete("prompt")
+            self.counted = True
+        elif not self.counted and len(self.inflight) > 0:
+            entry = self.inflight[0]
+            m = PromptMatcher.other_prompt_pattern.search(self.line)
+            for pattern, response in entry["rules"]:
+                if pattern.search(self.line):
+                    # answer the prompt matched by the expect rule at once.
+                    sendString += response + "\n"
+                    self.line = ""
+                    break
+            else:
+                if m is not None and m.lastgroup == "pager":
+                    # repeat send space for "--More--".(pager_window spaces at the first page)
+                    sendString += " " * (self.pager_window if entry["pages"] == 0 else 1)
+                    entry["pages"] += 1
+                    self.line = ""
+                elif m is not None:
+                    # The next command is the answer of the password or confirm prompt.
+                    self.complete(m.lastgroup, decoded_current_output[max(position + m.end(), 0):])
+                    if len(self.inflight) > 0:
+                        self.inflight[0]["alone"] = True
+                    else:
+                        self.answer_next = True
+                    self.counted = True
+
+        return sendString + self.send_ahead()
+
+    def get_prompt_end(self, line: str) -> int:
+        """
+        Position after the prompt(and the spaces after it) at the beginning of the line.
+        """
+        prompt_start = len(line) - len(line.lstrip("\r"))
+        prompt_end = prompt_start + max([len(_) for _ in self.prompts if line.startswith(_, prompt_start)])
+        return len(line) - len(line[prompt_end:].lstrip(" "))
+
+    def get_completed_count(self, echo: str) -> int:
+        """
+        Number of the commands in flight completed by the prompt, that is followed by the echo of a command.
+
+        The commands before the echoed command are completed.(the answer of a password prompt is not echoed)
+        Without the echo, or if the echo is not a command in flight, the oldest command is completed.
+        """
+        if len(self.inflight) == 0:
+            return 0
+        if echo != "":
+            for i in range(1, len(self.inflight)):
+                if self.inflight[i]["command"] is not None and self.inflight[i]["command"].strip() == echo:
+                    return i
+            if self.inflight[0]["command"] is not None and self.inflight[0]["command"].strip() == echo:
+                # The prompt before the oldest command, that is already completed.
+                return 0
+        return 1
+
+    def complete(self, completion: str, tail: str = ""):
+        """
+        Complete the oldest command in flight.(the output sections are split before the last tail characters)
+        """
+        entry = self.inflight.popleft()
+        if entry["command"] is not None:
+            if entry["fallbacks"] > 0:
+                completion = "timeout"
+            self.metrics.add_command(entry["label"], entry["send_time"], entry["first_byte_time"], time.time() - entry["send_time"],
+                                     entry["bytes"], entry["pages"], completion)
+            if self.wf is not None:
+                self.wf.end_section(completion, tail)
+            self.last_completion = completion
+        if len(self.inflight) > 0 and self.inflight[0]["command"] is not None:
+            self.inflight[0]["label"] = get_command_label(self.inflight[0]["command"], self.last_completion)
+            if self.wf is not None:
+                self.wf.begin_section(self.inflight[0]["label"], tail)
+
+    def finish(self):
+        """
+        The session is closed.
+        """
+        while len(self.inflight) > 0:
+            self.complete("eof")
+
+class ConnectionManager:
+    """
+    TCP connections with retry and circuit breaker.
+
+    The addresses of the device(resolved from ipaddr and cn.alt_addrs) are raced like
+    Happy Eyeballs(RFC 8305), the next address is tried every stagger seconds until one connects.
+    The failed connection is retried with exponential backoff and full jitter.
+    After breaker_threshold consecutive sessions of a host failed to connect,
+    the connections to the host fail immediately for breaker_cooldown seconds.
+    """
+    def __init__(self, connect_timeout=2.0, retries=2, backoff=0.5, max_backoff=10.0, stagger=0.25, breaker_threshold=3, breaker_cooldown=60.0):
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stagger = stagger
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.lock = threading.Lock()
+        # ipaddr -> [consecutive failures, open until]
+        self.breakers = {}
+
+    def get_addresses(self, cn: ConnectionInformation) -> List[Tuple[int, Tuple]]:
+        addresses = []
+        for host in [cn.ipaddr] + cn.alt_addrs:
+            try:
+                addrinfo = socket.getaddrinfo(host, int(cn.port), type=socket.SOCK_STREAM)
+            except socket.gaierror:
+                continue
+            for family, _, _, _, sockaddr in addrinfo:
+                if (family, sockaddr) not in addresses:
+                    addresses.append((family, sockaddr))
+        return addresses
+
+    async def get_addresses_async(self, cn: ConnectionInformation) -> List[Tuple[int, Tuple]]:
+        """
+        Same as get_addresses() on the event loop.(the hosts are resolved at the same time)
+        """
+        loop = asyncio.get_running_loop()
+        hosts = [cn.ipaddr] + cn.alt_addrs
+        results = await asyncio.gather(*[loop.getaddrinfo(host, int(cn.port), type=socket.SOCK_STREAM) for host in hosts], return_exceptions=True)
+        addresses = []
+        for addrinfo in results:
+            if isinstance(addrinfo, socket.gaierror):
+                continue
+            if isinstance(addrinfo, BaseException):
+                raise addrinfo
+            for family, _, _, _, sockaddr in addrinfo:
+                if (family, sockaddr) not in addresses:
+                    addresses.append((family, sockaddr))
+        return addresses
+
+    def check_breaker(self, cn: ConnectionInformation):
+        with self.lock:
+            breaker = self.breakers.get(cn.ipaddr)
+            if breaker is not None and breaker[1] > time.time():
+                raise ConnectionError("connect failed to {0}(skipped for {1:.0f}s)".format(cn.ipaddr, breaker[1] - time.time()))
+
+    def record(self, cn: ConnectionInformation, success: bool):
+        with self.lock:
+            if success:
+                self.breakers.pop(cn.ipaddr, None)
+                return
+            breaker = self.breakers.setdefault(cn.ipaddr, [0, 0.0])
+            breaker[0] += 1
+            if breaker[0] >= self.breaker_threshold:
+                breaker[1] = time.time() + self.breaker_cooldown
+
+    def get_backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def connect(self, cn: ConnectionInformation) -> socket.socket:
+        """
+        Connect to the device, and return the connected socket.
+        """
+        self.check_breaker(cn)
+        addresses = self.get_addresses(cn)
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.get_backoff(attempt - 1))
+            try:
+                sock = self.race(addresses)
+            except OSError:
+                continue
+            self.record(cn, True)
+            return sock
+        self.record(cn, False)
+        raise ConnectionError("connect failed to {0}".format(cn.ipaddr))
+
+    def race(self, addresses: List[Tuple[int, Tuple]]) -> socket.socket:
+        """
+        Start connecting to the next address every stagger seconds(or when a connection fails),
+        and return the first connected socket.
+        """
+        sel = selectors.DefaultSelector()
+        pending = list(addresses)
+        error = OSError("no address")
+        deadline = time.time() + self.connect_timeout
+        next_start = time.time()
+        try:
+            while True:
+                now = time.time()
+                if len(pending) > 0 and (now >= next_start or len(sel.get_map()) == 0):
+                    family, sockaddr = pending.pop(0)
+                    sock = socket.socket(family, socket.SOCK_STREAM)
+                    sock.setblocking(False)
+                    err = sock.connect_ex(sockaddr)
+                    if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK)):
+                        sel.register(sock, selectors.EVENT_WRITE)
+                        next_start = now + self.stagger
+                    else:
+                        sock.close()
+                        error = OSError(err, os.strerror(err))
+                    continue
+                if len(sel.get_map()) == 0:
+                    raise error
+                if now >= deadline:
+                    raise socket.timeout("timed out")
+
+                timeout = deadline - now
+                if len(pending) > 0:
+                    timeout = min(timeout, next_start - now)
+                for key, _ in sel.select(timeout):
+                    sock = key.fileobj
+                    sel.unregister(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err == 0:
+                        sock.setblocking(True)
+                        return sock
+                    sock.close()
+                    error = OSError(err, os.strerror(err))
+                    next_start = now
+        finally:
+            for key in list(sel.get_map().values()):
+                key.fileobj.close()
+            sel.close()
+
+    async def connect_async(self, cn: ConnectionInformation) -> socket.socket:
+        """
+        Connect to the device, and return the connected socket.(asyncio)
+        """
+        self.check_breaker(cn)
+        addresses = await self.get_addresses_async(cn)
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.get_backoff(attempt - 1))
+            try:
+                sock = await self.race_async(addresses)
+            except OSError:
+                continue
+            self.record(cn, True)
+            return sock
+        self.record(cn, False)
+        raise ConnectionError("connect failed to {0}".format(cn.ipaddr))
+
+    async def race_async(self, addresses: List[Tuple[int, Tuple]]) -> socket.socket:
+        """
+        Same as race() on the event loop.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def connect_address(family: int, sockaddr: Tuple) -> socket.socket:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await loop.sock_connect(sock, sockaddr)
+            except BaseException:
+                sock.close()
+                raise
+            return sock
+
+        pending = list(addresses)
+        tasks = set()
+        error = OSError("no address")
+        deadline = loop.time() + self.connect_timeout
+        try:
+            while True:
+                if len(pending) > 0:
+                    tasks.add(asyncio.ensure_future(connect_address(*pending.pop(0))))
+                if len(tasks) == 0:
+                    raise error
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    raise socket.timeout("timed out")
+                if len(pending) > 0:
+                    timeout = min(timeout, self.stagger)
+                done, tasks = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                connected = [task.result() for task in done if task.exception() is None]
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                if len(connected) > 0:
+                    for sock in connected[1:]:
+                        sock.close()
+                    return connected[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+class SSHConnectionPool:
+    """
+    Authenticated SSH connections keyed by (ipaddr, port, username).
+
+    Each session opens a new channel on the pooled connection,
+    and the connection idle for ttl seconds is closed.
+    With ttl=0, the connection is closed when the session releases it.
+    """
+    def __init__(self, ttl=0.0):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> [client, sessions, last_used]
+        self.connections = {}
+
+    def acquire(self, cn: ConnectionInformation) -> paramiko.SSHClient:
+        key = (cn.ipaddr, cn.port, cn.username)
+        with self.lock:
+            self.evict_idle()
+            entry = self.connections.get(key)
+            if entry is not None:
+                transport = entry[0].get_transport()
+                if transport is not None and transport.is_active():
+                    entry[1] += 1
+                    return entry[0]
+                del self.connections[key]
+                entry[0].close()
+
+        client = paramiko.SSHClient()
+    #   client.set_missing_host_key_policy(paramiko.WarningPolicy())
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        manager = connection_manager if connection_manager is not None else ConnectionManager()
+        sock = manager.connect(cn)
+        try:
+            client.connect(cn.ipaddr, port = int(cn.port), username = cn.username, password = cn.passwd, sock = sock)
+        except Exception:
+            sock.close()
+            raise
+
+        if self.ttl > 0:
+            with self.lock:
+                if key not in self.connections:
+                    self.connections[key] = [client, 1, time.time()]
+        return client
+
+    def release(self, cn: ConnectionInformation, client: paramiko.SSHClient, reuse: bool = True):
+        key = (cn.ipaddr, cn.port, cn.username)
+        with self.lock:
+            entry = self.connections.get(key)
+            if entry is None or entry[0] is not client:
+                # Not pooled.
+                client.close()
+                return
+            entry[1] -= 1
+            entry[2] = time.time()
+            if not reuse:
+                del self.connections[key]
+                client.close()
+            self.evict_idle()
+
+    def evict_idle(self):
+        """
+        Close the connections idle for ttl seconds.(lock must be held)
+        """
+        now = time.time()
+        for key, entry in list(self.connections.items()):
+            if entry[1] <= 0 and now - entry[2] >= self.ttl:
+                del self.connections[key]
+                entry[0].close()
+
+    def close_all(self):
+        with self.lock:
+            for entry in self.connections.values():
+                entry[0].close()
+            self.connections = {}
+
+class FleetResult:
+    def __init__(self, cmdlist_file_path, ipaddr, success, duration, message):
+        self.cmdlist_file_path = cmdlist_file_path
+        self.ipaddr = ipaddr
+        self.success = success
+        self.duration = duration
+        self.message = message
+
+def parse_seconds(value: str) -> float:
+    """
+    Seconds of the option, or None if it is not a number.
+    """
+    try:
+        seconds = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(seconds):
+        return None
+    return seconds
 
 def main():
     args = docopt.docopt(__doc__)
 #   print(args)
 
-    if args["<cmdlist_file>"]:
-        if not os.path.exists(args["<cmdlist_file>"]):
-            print("{0} is not exist.".format(args["<cmdlist_file>"]))
-            exit(1)
-        cmdlist_file_path = args["<cmdlist_file>"]
+    if args["--latest"]:
+        print_latest_sections(args["--store"], args["--latest"])
+        exit(0)
 
     logdir_path = "./log/"
     if args["--log_dir"]:
@@ -47,31 +1257,637 @@ def main():
     if args["--disable_log"]:
         disable_log_output = True
 
+    compress = ""
+    if args["--compress"]:
+        compress = args["--compress"]
+        if compress not in ("gzip", "xz"):
+            print("unknown compress method {0}".format(compress))
+            exit(1)
+
+    if args["--store"] and disable_log_output:
+        print("--store requires the log file")
+        exit(1)
+    if args["--diff"] and not args["--store"]:
+        print("--diff requires --store")
+        exit(1)
+
+    if args["--quiet"]:
+        global echo_console
+        echo_console = False
+
+    oi = OutputInformation(disable_log_output, logdir_path, compress, args["--raw_log"], args["--metrics"], args["--store"] or "", args["--diff"])
+    if args["--metrics_prom"]:
+        oi.metrics_sessions = []
+
+    global connection_manager
+    connection_manager = ConnectionManager()
+    if args["--connect_timeout"]:
+        connect_timeout = parse_seconds(args["--connect_timeout"])
+        if connect_timeout is None or connect_timeout <= 0:
+            print("--connect_timeout must be more than 0")
+            exit(1)
+        connection_manager.connect_timeout = connect_timeout
+    if args["--retries"]:
+        if not args["--retries"].isdigit():
+            print("--retries must be 0 or more")
+            exit(1)
+        connection_manager.retries = int(args["--retries"])
+
+    plan_cache_dir = ""
+    if args["--plan_cache"]:
+        plan_cache_dir = args["--plan_cache"].replace("\\", "/")
+
+    if args["--prompt_cache"]:
+        global prompt_cache
+        prompt_cache = PromptCache(args["--prompt_cache"].replace("\\", "/"))
+        if args["--prompt_cache_ttl"]:
+            prompt_cache_ttl = parse_seconds(args["--prompt_cache_ttl"])
+            if prompt_cache_ttl is None or prompt_cache_ttl < 0:
+                print("--prompt_cache_ttl must be 0 or more")
+                exit(1)
+            prompt_cache.ttl = prompt_cache_ttl
+
+    engine = "thread"
+    if args["--engine"]:
+        engine = args["--engine"]
+        if engine not in ("thread", "asyncio"):
+            print("unknown engine {0}".format(engine))
+            exit(1)
+
+    if args["--fleet"]:
+        global ssh_pool
+        ssh_pool_ttl = 60.0
+        if args["--ssh_pool_ttl"]:
+            ssh_pool_ttl = parse_seconds(args["--ssh_pool_ttl"])
+            if ssh_pool_ttl is None or ssh_pool_ttl < 0:
+                print("--ssh_pool_ttl must be 0 or more")
+                exit(1)
+        ssh_pool = SSHConnectionPool(ssh_pool_ttl)
+
+        workers = 8
+        if args["--workers"]:
+            if not args["--workers"].isdigit() or int(args["--workers"]) < 1:
+                print("--workers must be 1 or more")
+                exit(1)
+            workers = int(args["--workers"])
+        per_host = 1
+        if args["--per_host"]:
+            if not args["--per_host"].isdigit() or int(args["--per_host"]) < 1:
+                print("--per_host must be 1 or more")
+                exit(1)
+            per_host = int(args["--per_host"])
+        processes = 1
+        if args["--processes"]:
+            if not args["--processes"].isdigit():
+                print("--processes must be 0 or more")
+                exit(1)
+            processes = int(args["--processes"])
+            if processes <= 0:
+                processes = os.cpu_count() or 1
+
+        if args["--inventory"]:
+            try:
+                plans, results = load_inventory_plans(args["--fleet"], args["--inventory"], plan_cache_dir)
+            except (OSError, ValueError) as e:
+                print(e)
+                exit(1)
+            if len(plans) == 0 and len(results) == 0:
+                print("no target in {0}".format(args["--inventory"]))
+                exit(1)
+        else:
+            cmdlist_files = find_fleet_cmdlist_files(args["--fleet"])
+            if len(cmdlist_files) == 0:
+                print("no command list file in {0}".format(args["--fleet"]))
+                exit(1)
+            plans, results = load_fleet_plans(cmdlist_files, plan_cache_dir)
+
+        if processes > 1:
+            results += cmdlist_exec_fleet_processes(plans, processes, workers, per_host, oi, engine, ssh_pool_ttl)
+        elif engine == "asyncio":
+            results += asyncio.run(cmdlist_exec_fleet_plans_async(plans, workers, per_host, oi))
+        else:
+            results += cmdlist_exec_fleet_plans(plans, workers, per_host, oi)
+        ssh_pool.close_all()
+        if args["--metrics_prom"]:
+            write_metrics_prom(args["--metrics_prom"], oi.metrics_sessions)
+        print_fleet_summary(results)
+        for result in results:
+            if not result.success:
+                exit(1)
+        exit(0)
+
+    if args["<cmdlist_file>"]:
+        if not os.path.exists(args["<cmdlist_file>"]):
+            print("{0} is not exist.".format(args["<cmdlist_file>"]))
+            exit(1)
+        cmdlist_file_path = args["<cmdlist_file>"]
+
+    try:
+        try:
+            if engine == "asyncio":
+                success = asyncio.run(cmdlist_exec_file_async(cmdlist_file_path, oi, plan_cache_dir))
+            else:
+                success = cmdlist_exec_file(cmdlist_file_path, oi, plan_cache_dir)
+        except ConnectionError as e:
+            print(e)
+            exit(0)
+    finally:
+        if args["--metrics_prom"]:
+            write_metrics_prom(args["--metrics_prom"], oi.metrics_sessions)
+    if not success:
+        exit(0)
+
+def cmdlist_exec_file(cmdlist_file_path: str, oi: OutputInformation, plan_cache_dir: str = "") -> bool:
+    """
+    Execute one command list file.
+    """
     # read command list file.
-    lines = read_cmdlist_file(cmdlist_file_path)
+    plan = load_cmdlist_plan(cmdlist_file_path, plan_cache_dir)
+    if plan is None:
+        print("read failed {0}".format(cmdlist_file_path))
+        return False
+    return cmdlist_exec_plan(plan, oi)
 
-    # Set of standby prompt characters
-    prompts = [b">$", b"> $", b"#$", b"# $", b"\\$$", b"\\$ $", b"%$", b"% $", b"[Pp]assword: $", b"login: $", b"name: $"]
+def prepare_plan(plan: CmdlistPlan) -> (ConnectionInformation, List[Tuple[str, Dict[str, str]]]):
+    """
+    Read the connection information and the commands of the plan.(shared by the thread and asyncio engines)
+
+    return (None, None) if the plan cannot be executed.
+    """
+    cmdlist_file_path = plan.filename
 
     # Read connection information.
-    cn = set_ConnectionInformation(lines, timeout=2)
+    cn = plan.connection_information(timeout=2)
     if cn.ipaddr == "":
         print("no ipaddr in {0}".format(cmdlist_file_path))
-        exit(0)
-
-    # Execute command list.
+        return None, None
     if cn.port == "22":
         if cn.username == "":
             print("no username in {0}".format(cmdlist_file_path))
-            exit(0)
+            return None, None
         if cn.passwd == "":
             print("no password in {0}".format(cmdlist_file_path))
-            exit(0)
+            return None, None
+    return cn, expand_variables(plan.commands, plan.variables)
+
+def cmdlist_exec_plan(plan: CmdlistPlan, oi: OutputInformation) -> bool:
+    """
+    Execute one parsed command list file.
+    """
+    prompts = standby_prompts
+
+    cn, commands = prepare_plan(plan)
+    if cn is None:
+        return False
+
+    # Execute command list.
+    if cn.port == "22":
         # SSH
-        cmdlist_exec_ssh(lines, cn, prompts, disable_log_output, logdir_path)
+        if cn.ssh_mode == "exec":
+            cmdlist_exec_ssh_exec(commands, cn, oi)
+        else:
+            cmdlist_exec_ssh(commands, cn, prompts, oi)
     else:
         # TELNET
-        cmdlist_exec_telnet(lines, cn, prompts, disable_log_output, logdir_path)
+        cmdlist_exec_telnet(commands, cn, prompts, oi)
+    return True
+
+def find_fleet_cmdlist_files(fleet_target: str) -> List[str]:
+    """
+    Enumerate command list files for fleet mode.
+
+    fleet_target is one of the following.
+    directory     ... all "*.txt" files in the directory.
+    manifest file ... one command list file path per line.("#" and "//" are comments)
+    other         ... glob pattern.
+    """
+    if os.path.isdir(fleet_target):
+        return sorted(glob.glob(os.path.join(fleet_target, "*.txt")))
+
+    if os.path.isfile(fleet_target):
+        cmdlist_files = []
+        basedir = os.path.dirname(fleet_target)
+        for line in read_cmdlist_file(fleet_target):
+            # Delete comment section.
+            line = re.sub('#.*\n', "", line)
+            line = re.sub('//.*\n', "", line)
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            if not os.path.isabs(line):
+                line = os.path.join(basedir, line)
+            cmdlist_files.append(line)
+        return cmdlist_files
+
+    return sorted(glob.glob(fleet_target))
+
+def load_fleet_plans(cmdlist_files: List[str], plan_cache_dir: str = "") -> (List[CmdlistPlan], List[FleetResult]):
+    """
+    Read the command list files of the fleet, and return the plans and the results of the unreadable files.
+    """
+    plans = []
+    results = []
+    for cmdlist_file_path in cmdlist_files:
+        plan = load_cmdlist_plan(cmdlist_file_path, plan_cache_dir)
+        if plan is None:
+            results.append(FleetResult(cmdlist_file_path, "", False, 0.0, "read failed"))
+            continue
+        plans.append(plan)
+    return plans, results
+
+def read_inventory_file(inventory_filename: str) -> List[Dict[str, str]]:
+    """
+    Read the targets of the inventory file.
+
+    CSV(the first row is the column names), or YAML(a list of mappings, *.yml or *.yaml).
+    """
+    if inventory_filename.endswith((".yml", ".yaml")):
+        if yaml is None:
+            raise ValueError("PyYAML is required for the YAML inventory.(pip install pyyaml)")
+        with open(inventory_filename, "rt", encoding="utf-8") as f:
+            targets = yaml.safe_load(f) or []
+        if not isinstance(targets, list) or not all(isinstance(_, dict) for _ in targets):
+            raise ValueError("{0} is not a list of targets".format(inventory_filename))
+        return [{str(k): "" if v is None else str(v) for k, v in target.items()} for target in targets]
+
+    with open(inventory_filename, "rt", encoding="utf-8-sig", newline="") as f:
+        return [{k.strip(): (v or "").strip() for k, v in row.items() if k is not None} for row in csv.DictReader(f)]
+
+def load_inventory_plans(cmdlist_filename: str, inventory_filename: str, plan_cache_dir: str = "") -> (List[CmdlistPlan], List[FleetResult]):
+    """
+    Create the plans of the targets of the inventory file from one command list file.
+
+    The command list file is parsed once, and the commands are shared by all plans.
+    The variables of the targets are substituted when each session starts.
+    """
+    template = load_cmdlist_plan(cmdlist_filename, plan_cache_dir)
+    if template is None:
+        return [], [FleetResult(cmdlist_filename, "", False, 0.0, "read failed")]
+
+    plans = []
+    for target in read_inventory_file(inventory_filename):
+        plan = copy.copy(template)
+        plan.ipaddr = target.get("ipaddr") or template.ipaddr
+        plan.port = target.get("port") or template.port
+        plan.username = target.get("username") or template.username
+        plan.passwd = target.get("password") or template.passwd
+        if target.get("alt_addr"):
+            plan.alt_addrs = target["alt_addr"].split("|")
+        plan.variables = target
+        plan.filename = "{0}@{1}:{2}".format(cmdlist_filename, plan.ipaddr, plan.port)
+        plans.append(plan)
+    return plans, []
+
+def expand_variables(commands: List[Tuple[str, Dict[str, str]]], variables: Dict[str, str]) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Replace "{{name}}" in the commands and the responses of the expect rules with the variables.(unknown names are kept)
+    """
+    if len(variables) == 0:
+        return commands
+    def replace(m):
+        return variables.get(m.group(1), m.group(0))
+    expanded_commands = []
+    for line, options in commands:
+        if "expect" in options:
+            # The options of the plan are shared by the targets of the inventory.
+            options = dict(options, expect=[[pattern, variable_pattern.sub(replace, response)] for pattern, response in options["expect"]])
+        expanded_commands.append((variable_pattern.sub(replace, line), options))
+    return expanded_commands
+
+def cmdlist_exec_fleet_session(plan: CmdlistPlan, oi: OutputInformation) -> FleetResult:
+    """
+    Execute one command list file of the fleet, and never raise.
+    """
+    start_time = time.time()
+    success = False
+    message = ""
+    try:
+        success = cmdlist_exec_plan(plan, oi)
+        if not success:
+            message = "invalid command list file"
+    except Exception as e:
+        message = "{0}: {1}".format(type(e).__name__, e)
+    return FleetResult(plan.filename, "", success, time.time() - start_time, message)
+
+def cmdlist_exec_fleet_plans(plans: List[CmdlistPlan], workers: int, per_host: int, oi: OutputInformation) -> List[FleetResult]:
+    """
+    Execute many parsed command list files concurrently.
+
+    At most "workers" sessions run at the same time in total,
+    and at most "per_host" sessions run at the same time for each host.
+    """
+    results = []
+    pending = [(plan, plan.ipaddr) for plan in plans]
+
+    running = {}
+    host_sessions = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            # Start sessions while the global and per-host limits allow it.
+            for item in list(pending):
+                if len(running) >= workers:
+                    break
+                plan, ipaddr = item
+                if host_sessions.get(ipaddr, 0) >= per_host:
+                    continue
+                pending.remove(item)
+                host_sessions[ipaddr] = host_sessions.get(ipaddr, 0) + 1
+                future = executor.submit(cmdlist_exec_fleet_session, plan, oi)
+                running[future] = ipaddr
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                ipaddr = running.pop(future)
+                host_sessions[ipaddr] -= 1
+                result = future.result()
+                result.ipaddr = ipaddr
+                results.append(result)
+
+    return results
+
+def cmdlist_exec_fleet_processes(plans: List[CmdlistPlan], processes: int, workers: int, per_host: int, oi: OutputInformation,
+                                 engine: str = "thread", ssh_pool_ttl: float = 60.0) -> List[FleetResult]:
+    """
+    Execute many parsed command list files in several processes, so that decoding and matching of the output use all CPUs.
+
+    The hosts are split across the processes, so that the per_host limit, the SSH pool
+    and the circuit breaker of each host stay in one process.
+    The results and the metrics of the processes are gathered into this process.
+    """
+    results = []
+
+    # Assign the hosts with the most sessions first to the least loaded process.
+    hosts = {}
+    for plan in plans:
+        hosts.setdefault(plan.ipaddr, []).append(plan)
+    shards = [[] for _ in range(processes)]
+    for host_plans in sorted(hosts.values(), key=len, reverse=True):
+        min(shards, key=len).extend(host_plans)
+    shards = [shard for shard in shards if len(shard) > 0]
+    if len(shards) == 0:
+        return results
+    shard_workers = max(1, -(-workers // len(shards)))
+
+    manager = connection_manager if connection_manager is not None else ConnectionManager()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        futures = {}
+        for shard in shards:
+            future = executor.submit(cmdlist_exec_fleet_shard, shard, shard_workers, per_host, oi, engine, ssh_pool_ttl,
+                                     manager.connect_timeout, manager.retries, echo_console, prompt_cache)
+            futures[future] = shard
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                shard_results, shard_metrics = future.result()
+            except Exception as e:
+                # The process died, so all sessions of the shard are unknown.
+                message = "{0}: {1}".format(type(e).__name__, e)
+                results += [FleetResult(plan.filename, plan.ipaddr, False, 0.0, message) for plan in futures[future]]
+                continue
+            results += shard_results
+            if oi.metrics_sessions is not None:
+                oi.metrics_sessions += shard_metrics
+    return results
+
+def cmdlist_exec_fleet_shard(plans: List[CmdlistPlan], workers: int, per_host: int, oi: OutputInformation, engine: str, ssh_pool_ttl: float,
+                             connect_timeout: float, retries: int, echo: bool, cache: PromptCache = None) -> (List[FleetResult], List[SessionMetrics]):
+    """
+    Execute the plans of one process of cmdlist_exec_fleet_processes().
+
+    The module globals are set again, because the process may be spawned without them.
+    """
+    global echo_console, connection_manager, ssh_pool, prompt_cache
+    echo_console = echo
+    prompt_cache = cache
+    connection_manager = ConnectionManager(connect_timeout, retries)
+    ssh_pool = SSHConnectionPool(ssh_pool_ttl)
+    try:
+        if engine == "asyncio":
+            results = asyncio.run(cmdlist_exec_fleet_plans_async(plans, workers, per_host, oi))
+        else:
+            results = cmdlist_exec_fleet_plans(plans, workers, per_host, oi)
+    finally:
+        ssh_pool.close_all()
+    return results, oi.metrics_sessions or []
+
+def print_fleet_summary(results: List[FleetResult]):
+    """
+    Print the summary of fleet mode.
+    """
+    success_count = len([_ for _ in results if _.success])
+    total_duration = sum([_.duration for _ in results])
+
+    print("\n")
+    print("{0:<8} {1:>10} {2:<16} {3}".format("result", "duration", "ipaddr", "cmdlist_file"))
+    for result in sorted(results, key=lambda _: _.cmdlist_file_path):
+        status = "ok" if result.success else "failed"
+        print("{0:<8} {1:>9.2f}s {2:<16} {3} {4}".format(status, result.duration, result.ipaddr, result.cmdlist_file_path, result.message))
+    print("success: {0}, failure: {1}, total: {2}, session time: {3:.2f}s".format(success_count, len(results) - success_count, len(results), total_duration))
+
+def finish_session_metrics(metrics: SessionMetrics, wf: object, oi: OutputInformation):
+    """
+    Write the metrics of the session next to the log file, and keep them for --metrics_prom.
+    And append the output sections of the session to --store.
+    """
+    if wf is not None and wf.sections is not None:
+        wf.end_section("eof")
+        write_store_sections(oi.store, metrics, wf, oi.diff)
+    if not metrics.enabled:
+        return
+    if oi.metrics and isinstance(wf, LogWriter):
+        filename = wf.filename
+        for extension in (".gz", ".xz", ".log"):
+            if filename.endswith(extension):
+                filename = filename[:-len(extension)]
+        try:
+            metrics.write(filename + ".metrics.jsonl")
+        except OSError as e:
+            print("\n{0}".format(e))
+    if oi.metrics_sessions is not None:
+        oi.metrics_sessions.append(metrics)
+
+def close_session_log(wf: object, metrics: SessionMetrics, oi: OutputInformation):
+    """
+    Close the log file, and finish the metrics and the store of the session.
+    """
+    if wf is not None:
+        wf.close()
+    finish_session_metrics(metrics, wf, oi)
+
+def open_store(db_filename: str) -> sqlite3.Connection:
+    """
+    Open the output store.
+
+    The sections are only appended, so the latest output of a command is the largest id.
+    The output is stored once per sha256 in the blobs table.
+    """
+    conn = sqlite3.connect(db_filename, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS sections (id INTEGER PRIMARY KEY, host TEXT, port TEXT, session_time REAL, command TEXT, time REAL,"
+                 " completion TEXT, log_file TEXT, offset INTEGER, size INTEGER, sha256 TEXT, status TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS blobs (sha256 TEXT PRIMARY KEY, output TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS sections_command ON sections (command, host, port)")
+    conn.execute("CREATE INDEX IF NOT EXISTS sections_host ON sections (host, time)")
+    return conn
+
+def write_store_sections(db_filename: str, metrics: SessionMetrics, wf: LogWriter, diff: bool = False):
+    """
+    Append the output sections of the session to the store in one transaction.
+
+    The output is read back from the log file one section at a time.
+    If diff, each section is compared with the previous output of the same host and command,
+    and the log file is replaced with the changed output only.
+    """
+    try:
+        conn = open_store(db_filename)
+        try:
+            dw = None
+            if diff:
+                dw = LogWriter("{0}.{1}.tmp".format(wf.filename, os.getpid()), "", wf.compress)
+                dw.sections = []
+            rows = []
+            with conn:
+                try:
+                    for section, output in read_log_sections(wf):
+                        section["sha256"] = hashlib.sha256(output.encode("utf-8", errors="replace")).hexdigest()
+                        section["status"] = None
+                        if dw is not None:
+                            row = conn.execute("SELECT sections.sha256, blobs.output FROM sections"
+                                               " JOIN blobs ON sections.sha256 = blobs.sha256 WHERE command = ? AND host = ? AND port = ?"
+                                               " ORDER BY id DESC LIMIT 1", (section["command"], metrics.ipaddr, metrics.port)).fetchone()
+                            if row is None:
+                                section["status"] = "new"
+                            elif row[0] == section["sha256"]:
+                                section["status"] = "unchanged"
+                            else:
+                                section["status"] = "changed"
+                            write_diff_section(dw, section, output, row[1] if row is not None else None)
+                        conn.execute("INSERT OR IGNORE INTO blobs (sha256, output) VALUES (?, ?)", (section["sha256"], output))
+                        # The sections are inserted after the loop, so that a command repeated in the session is compared with the previous session.
+                        rows.append((metrics.ipaddr, metrics.port, metrics.start_time, section["command"], section["time"], section["completion"],
+                                     wf.filename, section["offset"], section["size"], section["sha256"], section["status"]))
+                finally:
+                    if dw is not None:
+                        dw.close()
+                conn.executemany("INSERT INTO sections (host, port, session_time, command, time, completion, log_file, offset, size, sha256, status)"
+                                 " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if dw is not None:
+                os.replace(dw.filename, wf.filename)
+                print_diff_report(metrics, wf.sections)
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        print("\n{0}".format(e))
+
+def read_log_sections(wf: LogWriter):
+    """
+    Read the output of each section back from the closed log file.(the offset and size are before compression)
+
+    yield (section, output), the newlines of the output are "\n".
+    """
+    with open_log_file(wf.filename, wf.compress, "rb") as f:
+        for section in wf.sections:
+            f.seek(section["offset"])
+            output = f.read(section["size"]).decode(wf.encoding, errors="replace")
+            yield section, output.replace("\r\n", "\n").replace("\r", "\n")
+
+def write_diff_section(dw: LogWriter, section: Dict[str, object], output: str, previous_output: str):
+    """
+    Write the changed output of the section to the diff log.
+
+    An unchanged command is one line, a changed command is the unified diff from the previous output,
+    and a new command is the whole output. The offset and size of the section are updated to the diff log.
+    """
+    dw.begin_section(section["command"])
+    dw.write("### {0}: {1}\n".format(section["status"], section["command"]))
+    if section["status"] == "new":
+        dw.write(output)
+        if not output.endswith("\n"):
+            dw.write("\n")
+    elif section["status"] == "changed":
+        # The last line is usually the prompt without a newline.
+        diff_lines = difflib.unified_diff((previous_output + "\n").splitlines(keepends=True), (output + "\n").splitlines(keepends=True),
+                                          "previous", "current")
+        dw.write("".join(diff_lines))
+    dw.end_section(section["completion"])
+    section["offset"] = dw.sections[-1]["offset"]
+    section["size"] = dw.sections[-1]["size"]
+
+def print_diff_report(metrics: SessionMetrics, sections: List[Dict[str, object]]):
+    """
+    Print the number of new, changed and unchanged commands of the session, and the changed commands.
+    """
+    count = {"new": 0, "changed": 0, "unchanged": 0}
+    for section in sections:
+        count[section["status"]] += 1
+    print("\ndiff {0}:{1} new={2} changed={3} unchanged={4}".format(metrics.ipaddr, metrics.port, count["new"], count["changed"], count["unchanged"]))
+    for section in sections:
+        if section["status"] == "changed":
+            print("  changed: {0}".format(section["command"]))
+
+def print_latest_sections(db_filename: str, command: str):
+    """
+    Print the latest output of the command for each host.
+    """
+    conn = open_store(db_filename)
+    try:
+        cursor = conn.execute("SELECT host, port, time, log_file, blobs.output FROM sections"
+                              " JOIN blobs ON sections.sha256 = blobs.sha256 WHERE id IN"
+                              " (SELECT MAX(id) FROM sections WHERE command = ? GROUP BY host, port) ORDER BY host, port", (command,))
+        for host, port, section_time, log_file, output in cursor:
+            print("### {0}:{1} {2} {3}".format(host, port, datetime.datetime.fromtimestamp(section_time).strftime("%Y/%m/%d %H:%M:%S"), log_file))
+            print(output, end="" if output.endswith("\n") else "\n")
+    finally:
+        conn.close()
+
+def write_metrics_prom(prom_filename: str, sessions: List[SessionMetrics]):
+    """
+    Write the metrics of the sessions as a Prometheus text file.(for node_exporter textfile collector)
+    """
+    hosts = {}
+    completions = {}
+    for metrics in sessions:
+        host = hosts.setdefault(metrics.ipaddr, {"sessions": 0, "connect": 0.0, "login": 0.0, "commands": 0, "prompt": 0.0,
+                                                 "first_byte": 0.0, "first_byte_count": 0, "bytes": 0, "pages": 0})
+        host["sessions"] += 1
+        host["connect"] += metrics.connect_time or 0.0
+        host["login"] += metrics.login_time or 0.0
+        for command in metrics.commands:
+            host["commands"] += 1
+            host["prompt"] += command["prompt_time"]
+            if command["first_byte_time"] is not None:
+                host["first_byte"] += command["first_byte_time"]
+                host["first_byte_count"] += 1
+            host["bytes"] += command["bytes"]
+            host["pages"] += command["pages"]
+            key = (metrics.ipaddr, command["completion"])
+            completions[key] = completions.get(key, 0) + 1
+
+    # The values are the totals of this run, so that all metrics are gauges.
+    lines = []
+    def metric(name, help_str, samples):
+        lines.append("# HELP pytelnetcmdexec_{0} {1}".format(name, help_str))
+        lines.append("# TYPE pytelnetcmdexec_{0} gauge".format(name))
+        for labels, value in samples:
+            label_str = ",".join('{0}="{1}"'.format(k, v) for k, v in labels)
+            if len(label_str) > 0:
+                label_str = "{" + label_str + "}"
+            lines.append("pytelnetcmdexec_{0}{1} {2}".format(name, label_str, value))
+
+    metric("sessions", "Number of sessions.", [((("host", h),), v["sessions"]) for h, v in hosts.items()])
+    metric("connect_seconds", "Time to establish the connections.", [((("host", h),), v["connect"]) for h, v in hosts.items()])
+    metric("login_seconds", "Time from the connections until the prompt.", [((("host", h),), v["login"]) for h, v in hosts.items()])
+    metric("commands", "Number of commands by completion.", [((("host", h), ("completion", c)), v) for (h, c), v in completions.items()])
+    metric("command_seconds", "Time from sending the commands until the completion.", [((("host", h),), v["prompt"]) for h, v in hosts.items()])
+    metric("command_first_byte_seconds", "Time from sending the commands until the first output.", [((("host", h),), v["first_byte"]) for h, v in hosts.items()])
+    metric("received_bytes", "Bytes received by the commands.", [((("host", h),), v["bytes"]) for h, v in hosts.items()])
+    metric("pages", "Number of \"--More--\" pages answered.", [((("host", h),), v["pages"]) for h, v in hosts.items()])
+    metric("last_run_timestamp_seconds", "Time when the run finished.", [((), time.time())])
+
+    # Replace the file at once, so that the collector never reads a partial file.
+    tmp_filename = "{0}.{1}.tmp".format(prom_filename, os.getpid())
+    with open(tmp_filename, "wt", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_filename, prom_filename)
 
 def read_cmdlist_file(cmdlist_filename: str) -> List[str]:
     """
@@ -90,55 +1906,289 @@ def read_cmdlist_file(cmdlist_filename: str) -> List[str]:
             continue
     return contents
 
-def set_ConnectionInformation(lines: List[str], timeout: int) -> ConnectionInformation:
+def parse_cmdlist(cmdlist_filename: str, lines: List[str]) -> CmdlistPlan:
     """
-    Read connection information.
+    Parse command list file.
+
+    The first line that contains ":" is the connection information.
+    "ipaddr:port[,username,password]"
+    The following lines are the commands.
+
+    "#@expect <regex> send <response>" lines after a command answer the prompts of the command,
+    and "#@respond <regex> send <response>" lines answer the prompts of all commands.
+    When the last line of the output matches <regex>, <response> and a newline are sent at once.
     """
-    cn = ConnectionInformation("", "", "", "", timeout)
-    count = 0
-    for line in lines:
+    plan = CmdlistPlan(cmdlist_filename, "", "", "", "", "", [])
+    for i, line in enumerate(lines):
+        options = parse_command_options(line)
+
         # Delete comment section.
-        line = re.sub('#.*\n', "", line)
-        line = re.sub('//.*\n', "", line)
-        line = line.strip()
-        if len(line) == 0:
+        line = CmdlistPlan.comment_pattern.sub("", line).strip()
+        if ":" not in line:
             continue
-        if count == 0:
-            if ":" in line:
-                flds = line.split(":")
-                if len(flds) > 1:
-                    cn.ipaddr = flds[0]
-                    flds1 = flds[1].split(",")
-                    cn.port = flds1[0]
-                    if len(flds1) > 1:
-                        cn.username = flds1[1]
-                        cn.passwd = flds1[2]
-                if cn.ipaddr != "":
-                    break
-    return cn
+        flds = line.split(":")
+        plan.ipaddr = flds[0]
+        flds1 = flds[1].split(",")
+        plan.port = flds1[0]
+        if len(flds1) > 1:
+            plan.username = flds1[1]
+        if len(flds1) > 2:
+            plan.passwd = flds1[2]
+        plan.encoding = options.get("encoding", "")
+        plan.ssh_mode = options.get("ssh_mode", "shell")
+        if options.get("parallel", "").isdigit():
+            plan.parallel = max(int(options["parallel"]), 1)
+        plan.platform = options.get("platform", "auto")
+        if options.get("pager_window", "").isdigit():
+            plan.pager_window = max(int(options["pager_window"]), 1)
+        if options.get("pipeline", "").isdigit():
+            plan.pipeline = max(int(options["pipeline"]), 1)
+        if options.get("alt_addr", "") != "":
+            plan.alt_addrs = options["alt_addr"].split("|")
+        break
+    else:
+        return plan
+
+    respond_rules = []
+    for line in lines[i + 1:]:
+        m = CmdlistPlan.expect_pattern.match(line.strip())
+        if m is not None:
+            kind, pattern, response = m.groups()
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                print("invalid expect pattern {0} in {1}: {2}".format(pattern, cmdlist_filename, e))
+                continue
+            if kind == "respond":
+                respond_rules.append([pattern, response or ""])
+            elif len(plan.commands) > 0:
+                plan.commands[-1][1].setdefault("expect", []).append([pattern, response or ""])
+            continue
+
+        options = parse_command_options(line)
+        for key in ("timeout", "idle_timeout"):
+            if key in options and not is_valid_seconds(options[key]):
+                print("invalid {0}={1} in {2}".format(key, options[key], cmdlist_filename))
+                del options[key]
+
+        # Delete comment section.
+        line = CmdlistPlan.comment_pattern.sub("", line).rstrip()
+        plan.commands.append((line, options))
+
+    if len(respond_rules) > 0:
+        for line, options in plan.commands:
+            options["expect"] = options.get("expect", []) + respond_rules
+    return plan
+
+def is_valid_seconds(value: str) -> bool:
+    try:
+        return 0 < float(value) < float("inf")
+    except ValueError:
+        return False
+
+def load_cmdlist_plan(cmdlist_filename: str, plan_cache_dir: str = "") -> CmdlistPlan:
+    """
+    Read and parse command list file.
+
+    If plan_cache_dir is specified, the parsed command list is cached in it.
+    The cache is used when the size and mtime of the file are not changed,
+    or when the sha256 of the file is not changed.
+    """
+    try:
+        with open(cmdlist_filename, "rb") as f:
+            contents = f.read()
+            st = os.fstat(f.fileno())
+    except OSError:
+        return None
+
+    if plan_cache_dir != "":
+        cache_filename = os.path.join(plan_cache_dir, hashlib.sha256(os.path.abspath(cmdlist_filename).encode()).hexdigest() + ".json")
+        try:
+            with open(cache_filename, "rt", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache["version"] == CmdlistPlan.version:
+                if cache["mtime_ns"] == st.st_mtime_ns and cache["size"] == st.st_size:
+                    return CmdlistPlan.from_dict(cmdlist_filename, cache["plan"])
+                if cache["sha256"] == hashlib.sha256(contents).hexdigest():
+                    return CmdlistPlan.from_dict(cmdlist_filename, cache["plan"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    lines = None
+    encodings = ["ascii", "sjis", "utf8"]
+    for enc in encodings:
+        try:
+            lines = contents.decode(enc).splitlines(keepends=True)
+            break
+        except UnicodeDecodeError:
+            continue
+    if lines is None:
+        return None
+    plan = parse_cmdlist(cmdlist_filename, lines)
+
+    if plan_cache_dir != "":
+        # The cache file contains the password, so only the owner can read it.
+        cache = {"version": CmdlistPlan.version, "mtime_ns": st.st_mtime_ns, "size": st.st_size,
+                 "sha256": hashlib.sha256(contents).hexdigest(), "plan": plan.to_dict()}
+        try:
+            os.makedirs(plan_cache_dir, exist_ok=True)
+            tmp_filename = "{0}.{1}.tmp".format(cache_filename, os.getpid())
+            fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wt", encoding="utf-8") as f:
+                json.dump(cache, f)
+            os.replace(tmp_filename, cache_filename)
+        except OSError:
+            pass
+
+    return plan
+
+def detect_platform_profile(cn: ConnectionInformation, banner: str, prompt_str: str) -> PlatformProfile:
+    """
+    Detect the platform from the login output and the prompt.
+    """
+    if cn.platform == "none":
+        return None
+    for profile in platform_profiles:
+        if cn.platform == profile.name:
+            return profile
+    if cn.platform != "auto":
+        return None
+    for profile in platform_profiles:
+        if profile.banner_pattern is not None and profile.banner_pattern.search(banner):
+            return profile
+    for profile in platform_profiles:
+        if profile.prompt_pattern is not None and profile.prompt_pattern.search(prompt_str):
+            return profile
+    return None
+
+def load_prompt_profile(cn: ConnectionInformation) -> Dict[str, object]:
+    """
+    Load the prompts and the platform learned from the host.(None unless --prompt_cache)
+    """
+    if prompt_cache is None:
+        return None
+    return prompt_cache.load(cn)
+
+def match_prompt_profile(prompt_profile: Dict[str, object], prompt_str: str) -> bool:
+    if prompt_profile is None:
+        return False
+    return prompt_str.rstrip(" ") in [_.rstrip(" ") for _ in prompt_profile["prompt_list"]]
+
+def detect_login_prompt(decoded_current_output: str, prompt_profile: Dict[str, object]) -> (List[str], List[str]):
+    """
+    Detect the prompt after login, and return (prompt_list, candidate).
+
+    With the learned prompts, another prompt-like line(such as the end of the banner)
+    is returned as the candidate, which is used only if no more output arrives.
+    """
+    prompt_list = detect_prompt_string(decoded_current_output)
+    if prompt_list is None or prompt_profile is None or match_prompt_profile(prompt_profile, prompt_list[0]):
+        return prompt_list, None
+    return None, prompt_list
+
+def learn_platform_profile(cn: ConnectionInformation, banner: str, prompt_list: List[str], prompt_profile: Dict[str, object]) -> PlatformProfile:
+    """
+    Detect the platform, or use the platform learned from the host if the prompt is the learned one.
+    The new prompts and platform are saved to --prompt_cache.
+    """
+    if match_prompt_profile(prompt_profile, prompt_list[0]):
+        if cn.platform != "auto" or prompt_profile["platform"] == "auto":
+            return detect_platform_profile(cn, banner, prompt_list[0])
+        for profile in platform_profiles:
+            if profile.name == prompt_profile["platform"]:
+                return profile
+        return None
+
+    profile = detect_platform_profile(cn, banner, prompt_list[0])
+    if prompt_cache is not None:
+        platform = "auto"
+        if cn.platform == "auto":
+            platform = profile.name if profile is not None else "none"
+        prompt_cache.save(cn, prompt_list, platform)
+    return profile
+
+def inject_pager_off_commands(profile: PlatformProfile, commands: List[Tuple[str, Dict[str, str]]]) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Insert the pager-disable commands of the platform before the command list.
+    (unless the command list already has them)
+    """
+    if profile is None:
+        return commands
+    command_set = set([line.strip() for line, _ in commands])
+    pager_off_commands = [(line, {}) for line in profile.pager_off_commands if line not in command_set]
+    return pager_off_commands + skip_blank_commands(commands)
 
-def print_and_append(buffer: List[str], outputString: str):
+def get_pager_window(cn: ConnectionInformation, profile: PlatformProfile) -> int:
+    """
+    Number of pager responses sent at the first pager prompt of a command.
+    """
+    if cn.pager_window > 0:
+        return cn.pager_window
+    if profile is not None:
+        return profile.pager_window
+    return 1
+
+def is_paging_disabled(profile: PlatformProfile, commands: List[Tuple[str, Dict[str, str]]]) -> bool:
+    """
+    The pager prompt is never shown.(the platform has no pager, or a pager-disable command is in the commands)
+    """
+    if profile is not None and not profile.paging:
+        return True
+    pager_off_commands = set([line for _ in platform_profiles for line in _.pager_off_commands])
+    return any([line.strip() in pager_off_commands for line, _ in commands])
+
+def get_command_label(line: str, previous_completion: str) -> str:
+    """
+    Command text of the log section and the metrics.(the answer of a password prompt is masked)
+    """
+    if previous_completion == "password":
+        return "********"
+    return line
+
+def skip_blank_commands(commands: List[Tuple[str, Dict[str, str]]]) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Skip the blank lines before the first command.
+    """
+    for i, (line, _) in enumerate(commands):
+        if len(line) > 0:
+            return commands[i:]
+    return []
+
+def print_and_append(buffer: OutputLog, outputString: str):
     """
     print and append to list output string.
     """
-    print(outputString, end="")
+    if echo_console:
+        print(outputString, end="")
     if buffer is not None:
         buffer.append(outputString)
 
-def connect_telnet_from_connectionInformation(cn: ConnectionInformation, prompts: List[bytes]):
+def open_telnet(cn: ConnectionInformation) -> telnetlib.Telnet:
+    """
+    Open telnetlib.Telnet on the socket of ConnectionManager.
+    """
+    manager = connection_manager if connection_manager is not None else ConnectionManager()
+    sock = manager.connect(cn)
+    sock.settimeout(cn.timeout)
+    tn = telnetlib.Telnet()
+    tn.host = cn.ipaddr
+    tn.port = int(cn.port)
+    tn.timeout = cn.timeout
+    tn.sock = sock
+    return tn
+
+def connect_telnet_from_connectionInformation(cn: ConnectionInformation, prompts: List[bytes], decoder: StreamDecoder, metrics: SessionMetrics):
     """
     Start telnet connection.
     """
-    current_output_log = []
-    tn = telnetlib.Telnet(cn.ipaddr, cn.port, cn.timeout)
-
-    if tn is None:
-        return None, None
+    current_output_log = OutputLog()
+    tn = open_telnet(cn)
+    metrics.connected()
 
     if cn.username != "":
         # Wait for username prompt.
         current_output = tn.read_until(b': ', cn.timeout)
-        print_and_append(current_output_log, current_output.decode())
+        print_and_append(current_output_log, decoder.decode(current_output))
 
         # Send Username
         tn.write(cn.username.encode() + b"\n")
@@ -146,7 +2196,7 @@ def connect_telnet_from_connectionInformation(cn: ConnectionInformation, prompts
 
         # Wait for password prompt.
         current_output = tn.read_until(b': ', cn.timeout)
-        print_and_append(current_output_log, current_output.decode())
+        print_and_append(current_output_log, decoder.decode(current_output))
 
         # Send password
         tn.write(cn.passwd.encode() + b"\n")
@@ -155,89 +2205,57 @@ def connect_telnet_from_connectionInformation(cn: ConnectionInformation, prompts
     else:
         # Wait for password prompt.
         current_output = tn.read_until(b': ', cn.timeout)
-        print_and_append(current_output_log, current_output.decode())
-
-    # Wait for prompt.
-    current_output = tn.expect(prompts, timeout=4)
-    decoded_current_output = decode(current_output[2])
-    print_and_append(current_output_log, decoded_current_output)
+        print_and_append(current_output_log, decoder.decode(current_output))
 
-    return tn, current_output_log
-
-def connect_telnet_from_lines(cn: ConnectionInformation, lines: List[str], prompts: List[bytes]) -> (telnetlib.Telnet, List[str], List[str]):
-    """
-    Start telnet connection.
-    """
-    current_output_log = []
-    try:
-        tn = telnetlib.Telnet(cn.ipaddr, cn.port, cn.timeout)
-    except:
-        print("connect failed to {0}".format(cn.ipaddr))
-        exit(0)
-
-    if tn is None:
-        return None, None
+        # Send password
+        tn.write(cn.passwd.encode() + b"\n")
+        print_and_append(current_output_log, cn.passwd + "\n")
 
+    # Wait for prompt.
     current_output = tn.expect(prompts, timeout=4)
-    decoded_current_output = decode(current_output[2])
+    decoded_current_output = decoder.decode(current_output[2])
     print_and_append(current_output_log, decoded_current_output)
 
-    line_count = 0
-    for i, _ in enumerate(lines):
-        # Delete comment section.
-        line = re.sub('#.*\n', "", lines[i])
-        line = re.sub('//.*\n', "", line)
-        line = line.rstrip()
-
-        if line_count == 0:
-            if len(line) == 0:
-                continue
-            if ":" in line:
-                line_count += 1
-                continue
-
-        elif line_count == 1:
-            # Send Username or Passwd
-            tn.write(line.encode() + b"\n")
+    return tn, current_output_log
 
-            # Wait for prompt.
-            try:
-                current_output = tn.expect(prompts, timeout=4)
-            except:
-                pass
-            decoded_current_output = decode(current_output[2])
-            print_and_append(current_output_log, decoded_current_output)
+def connect_telnet_from_lines(cn: ConnectionInformation, commands: List[Tuple[str, Dict[str, str]]], prompts: List[bytes], decoder: StreamDecoder, metrics: SessionMetrics) -> (telnetlib.Telnet, List[str], List[Tuple[str, Dict[str, str]]]):
+    """
+    Start telnet connection.
 
-            if current_output[0] < 8:
-                break
-            else:
-                line_count += 1
-                continue
+    The first commands are username and password, and the rest of commands is returned.
+    """
+    current_output_log = OutputLog()
+    tn = open_telnet(cn)
+    metrics.connected()
 
-        elif line_count == 2:
-            # Send password
-            tn.write(line.encode() + b"\n")
+    current_output = tn.expect(prompts, timeout=4)
+    decoded_current_output = decoder.decode(current_output[2])
+    print_and_append(current_output_log, decoded_current_output)
 
-            try:
-                current_output = tn.expect(prompts, timeout=4)
-            except:
-                tn.close()
-                return None, None
+    i = -1
+    for i, (line, _) in enumerate(commands[:2]):
+        # Send Username or Passwd
+        tn.write(line.encode() + b"\n")
 
-            decoded_current_output = decode(current_output[2])
-            print_and_append(current_output_log, decoded_current_output)
+        # Wait for prompt.
+        try:
+            current_output = tn.expect(prompts, timeout=4)
+        except EOFError:
+            tn.close()
+            raise ConnectionError("loggin failed to {0}".format(cn.ipaddr))
+        decoded_current_output = decoder.decode(current_output[2])
+        print_and_append(current_output_log, decoded_current_output)
 
-            if current_output[0] < 8:
-                break
-            else:
-                tn.close()
-                return None, None
+        if current_output[0] < 8:
+            break
+        if i == 1:
+            tn.close()
+            raise ConnectionError("loggin failed to {0}".format(cn.ipaddr))
 
     # Wait for prompt.
-    decoded_current_output = decode(current_output[2])
     print_and_append(current_output_log, decoded_current_output)
 
-    return tn, current_output_log, lines[i + 1:]
+    return tn, current_output_log, skip_blank_commands(commands[i + 1:])
 
 def detect_prompt_string(decoded_current_output: str) -> List[str]:
     """
@@ -280,41 +2298,51 @@ def detect_prompt_string(decoded_current_output: str) -> List[str]:
 
     return prompt_list
 
-def match_prompt_list(target_str: str, prompt_list: List[str]) -> bool:
-    """
-    Matches any of the prompt candidate strings.
+def parse_command_options(line: str) -> Dict[str, str]:
     """
-    for prompt_str in prompt_list:
-        if target_str == prompt_str:
-            return True
-    return False
+    Read the inline directive of a command line.
 
-def lastline_pattern_match(decoded_current_output: str, patterns: List[str]) -> int:
-    """
-    detect prompt string.
+    Example)
+    "show tech-support  #@timeout=600"  ... {"timeout": "600"}
+    "reload  #@idle_timeout=5"          ... {"idle_timeout": "5"}
+
+    timeout      ... wait for the prompt up to this many seconds before the idle fallback.
+    idle_timeout ... fixed idle timeout for this command instead of the adaptive one.
+
+    The directives of the connection information line.
+    "192.168.1.1:22,user,pass  #@ssh_mode=exec,parallel=4"
+
+    encoding     ... encoding of the output.
+    ssh_mode     ... "exec" runs each command on its own exec channel.(default="shell")
+    parallel     ... number of exec channels that run at the same time.(default=1)
+    platform     ... platform profile, "auto" or "none" or the name of the profile.(default="auto")
+    pager_window ... number of pager responses sent at the first pager prompt of a command.
+    pipeline     ... number of commands sent ahead without waiting for the prompt.(default=1)
+    alt_addr     ... other addresses of the device separated by "|", raced with the ipaddr.
     """
-    lastLine = decoded_current_output.split("\n")[-1]
-    for i, _ in enumerate(patterns):
-        res = re.match(patterns[i], lastLine)
-        if res is not None:
-            return i
-    return -1
-
-def decode(current_output: bytes) -> str:
+    options = {}
+    pos = line.find("#@")
+    if pos < 0:
+        return options
+    for fld in line[pos + 2:].replace(",", " ").split():
+        if "=" in fld:
+            key, value = fld.split("=", 1)
+            options[key] = value
+    return options
+
+def get_command_deadline(idle_timeout: AdaptiveIdleTimeout, options: Dict[str, str], command_send_time: float, last_receive_time: float) -> float:
     """
-    bytes to str
+    Time when the idle fallback sends a newline, if the prompt has not been matched.
     """
-    encodings = ["sjis", "utf8", "ascii"]
-    decoded_current_output = ""
-    for enc in encodings:
-        try:
-            decoded_current_output = current_output.decode(enc)
-            break
-        except:
-            continue
-    return decoded_current_output
+    if "idle_timeout" in options:
+        deadline = last_receive_time + float(options["idle_timeout"])
+    else:
+        deadline = last_receive_time + idle_timeout.get_timeout()
+    if "timeout" in options:
+        deadline = max(deadline, command_send_time + float(options["timeout"]))
+    return deadline
 
-def set_output_filename(prompt_str: List[str], cn: ConnectionInformation, logdir_path: str) -> str:
+def set_output_filename(prompt_str: List[str], cn: ConnectionInformation, logdir_path: str, extension: str = ".log") -> str:
     """
     set log output filename.
     """
@@ -326,10 +2354,43 @@ def set_output_filename(prompt_str: List[str], cn: ConnectionInformation, logdir
 
     if logdir_path[-1] != "/":
         logdir_path += "/"
-    output_filename = logdir_path + prompt_str + "_" + cn.ipaddr + dtStr + ".log"
+    output_filename = logdir_path + prompt_str + "_" + cn.ipaddr + dtStr + extension
+
+    # Reserve the filename, so that concurrent sessions never share a log file.
+    count = 0
+    while True:
+        try:
+            fd = os.open(output_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+            break
+        except FileExistsError:
+            count += 1
+            output_filename = logdir_path + prompt_str + "_" + cn.ipaddr + dtStr + "_" + str(count) + extension
 
     return output_filename
 
+def open_log_writer(prompt_str: str, cn: ConnectionInformation, oi: OutputInformation, string_remove: str, decoder: StreamDecoder) -> LogWriter:
+    """
+    Open the log file of the session.(or the callback of OutputInformation)
+
+    The raw log file has the device bytes as they are, and only CR is removed.
+    """
+    extension = ".log"
+    if oi.compress == "gzip":
+        extension += ".gz"
+    elif oi.compress == "xz":
+        extension += ".xz"
+    if oi.callback is not None:
+        return CallbackWriter(oi.callback)
+    output_filename = set_output_filename(prompt_str, cn, oi.logdir_path, extension)
+    if oi.raw_log:
+        wf = LogWriter(output_filename, "\r", oi.compress, raw=True, encoding=decoder.encoding or "utf-8")
+    else:
+        wf = LogWriter(output_filename, string_remove, oi.compress)
+    if oi.store != "":
+        wf.sections = []
+    return wf
+
 def remove_prohibited_characters(prompt_str: str) -> str:
     """
     Remove prohibited characters.
@@ -346,48 +2407,69 @@ def remove_prohibited_characters(prompt_str: str) -> str:
 
     return result_str
 
-def telnet_read_all(tn: telnetlib.Telnet, wf: object, current_output_log: List[str], enable_removeLF: bool) -> str:
+def create_read_selector(fileobj: object) -> selectors.BaseSelector:
     """
-    Dealing with unread material.
+    Create a selector that waits for received data on a socket or channel.
     """
-    try:
-        current_output = tn.read_all()
-    except:
-        current_output = ""
-
-    decoded_current_output = decode(current_output)
-    if len(current_output) > 0:
-        if enable_removeLF:
-            print_and_write(decoded_current_output, wf, current_output_log, string_remove = "\n")
-        else:
-            print_and_write(decoded_current_output, wf, current_output_log, string_remove = "")
-    return decoded_current_output
+    sel = selectors.DefaultSelector()
+    sel.register(fileobj, selectors.EVENT_READ)
+    return sel
 
-def telnet_read_eager(tn: telnetlib.Telnet, wf: object, current_output_log: List[str], enable_removeLF: bool) -> str:
+def wait_read(sel: selectors.BaseSelector, read_ready: Callable[[], bytes], deadline: float = None) -> bytes:
     """
-    Dealing with unread material.
+    Wait for received data until the deadline.(None waits forever)
+
+    read_ready() returns the received data, b"" if nothing is ready, or raises EOFError.
+    The thread sleeps on sel between the calls, so no CPU is used while the device is silent.
+    return None on timeout, b"" on EOF.
     """
+    while True:
+        try:
+            data = read_ready()
+        except EOFError:
+            return b""
+        if len(data) > 0:
+            return data
+        if deadline is None:
+            sel.select()
+            continue
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            return None
+        sel.select(timeout)
+
+def print_and_write_bytes(current_output: bytes, decoder: StreamDecoder, wf: object, current_output_log: List[str], string_remove: str, decode_all: bool = False) -> str:
     """
-    if tn.eof == True:
-        return ""
+    Decode the output, and write to stdout and file.
+
+    The raw log file gets the bytes as they are. If the decoded output is not echoed,
+    only the last line is decoded for prompt detection.(unless decode_all)
     """
-    current_output = tn.read_eager()
-    decoded_current_output = decode(current_output)
-    if len(current_output) > 0:
-        if enable_removeLF:
-            print_and_write(decoded_current_output, wf, current_output_log, string_remove = "\n")
-        else:
-            print_and_write(decoded_current_output, wf, current_output_log, string_remove = "")
+    if isinstance(wf, LogWriter) and wf.raw:
+        wf.write_bytes(current_output)
+        if not echo_console and not decode_all:
+            return decoder.decode_tail(current_output)
+        decoded_current_output = decoder.decode(current_output)
+        if echo_console:
+            print(decoded_current_output, end="")
+        return decoded_current_output
+
+    decoded_current_output = decoder.decode(current_output)
+    print_and_write(decoded_current_output, wf, current_output_log, string_remove)
     return decoded_current_output
 
 def print_and_write(outputString: str, wf: object, current_output_log: List[str], string_remove: str):
     """
     Write to stdout and file.
     """
-    print(outputString, end="")
+    if echo_console:
+        print(outputString, end="")
     if wf is not None:
         try:
-            if len(string_remove) > 0:
+            if isinstance(wf, (LogWriter, CallbackWriter)):
+                # LogWriter removes string_remove from the whole block.
+                wf.write(outputString)
+            elif len(string_remove) > 0:
                 wf.write(outputString.replace(string_remove, ""))
             else:
                 wf.write(outputString)
@@ -421,320 +2503,986 @@ def isPromptsEnd(decoded_current_output: List[str]) -> bool:
 
     return False
 
-def cmdlist_exec_telnet(lines: List[str], cn: ConnectionInformation, prompts: List[bytes], disable_log_output: bool, logdir_path: str):
+class TelnetStream:
     """
-    Execute command list(TELNET)
+    telnetlib.Telnet with the same interface as AsyncTelnetStream.(blocking)
     """
-    # Start TELNET connection
-    if cn.username != "" or cn.passwd != "":
-        tn, current_output_log = connect_telnet_from_connectionInformation(cn, prompts)
-    else:
-        tn, current_output_log, lines = connect_telnet_from_lines(cn, lines, prompts)
+    def __init__(self, tn: telnetlib.Telnet):
+        self.tn = tn
+        # Wake up as soon as the data arrives.
+        self.sel = create_read_selector(tn)
+        self.eof = False
+        self.string_remove = "\n"
+        # The output after the last prompt is read without waiting.
+        self.unread_timeout = 0
+
+    def read_some(self, timeout: float) -> bytes:
+        """
+        Read received data.
+        return None on timeout, b"" on EOF.
+        """
+        data = wait_read(self.sel, self.tn.read_eager, time.time() + timeout)
+        if data == b"":
+            self.eof = True
+        return data
+
+    def write(self, buffer: bytes):
+        self.tn.write(buffer)
+
+    def close(self):
+        self.sel.close()
+        self.tn.close()
+
+class SSHShellStream:
+    """
+    Interactive shell of paramiko with the same interface as AsyncTelnetStream.(blocking)
+    """
+    def __init__(self, channel: paramiko.Channel):
+        self.channel = channel
+        # Wake up as soon as the data arrives.
+        self.sel = create_read_selector(channel)
+        self.eof = False
+        self.string_remove = "\r"
+        # Wait a little for the output after the last prompt.
+        self.unread_timeout = 0.5
+
+    def read_some(self, timeout: float) -> bytes:
+        """
+        Read received data.(timeout None waits forever)
+        return None on timeout, b"" on EOF.
+        """
+        data = wait_read(self.sel, self.read_ready, time.time() + timeout if timeout is not None else None)
+        if data == b"":
+            self.eof = True
+        return data
+
+    def read_ready(self) -> bytes:
+        if self.channel.recv_ready():
+            return self.channel.recv(65536 * 10)
+        if self.channel.closed or self.channel.eof_received:
+            raise EOFError
+        return b""
+
+    def write(self, buffer: bytes):
+        self.channel.sendall(buffer)
+
+    def close(self):
+        self.sel.close()
+        self.channel.close()
+
+class Session:
+    """
+    telnet/ssh session of one device.(protocol is "telnet" or "ssh", by default port "22" is ssh)
 
-    if tn is None:
-        print("loggin failed to {0}".format(cn.ipaddr))
-        exit(0)
+    Example)
+    cn = ConnectionInformation("192.168.1.1", "23", "", "password", timeout=2)
+    with Session(cn) as session:
+        session.connect()
+        for decoded_current_output in session.run("show version"):
+            ...
+
+    The output is also written to stdout and the log file as OutputInformation says.
+    (the log file is disabled by default)
+    Connection and login failures raise ConnectionError.
+    """
+    def __init__(self, cn: ConnectionInformation, oi: OutputInformation = None, prompts: List[bytes] = None, protocol: str = ""):
+        if protocol == "":
+            protocol = "ssh" if cn.port == "22" else "telnet"
+        if oi is None:
+            oi = OutputInformation(True, "./log/", "")
+        if prompts is None:
+            prompts = standby_prompts
+        self.cn = cn
+        self.oi = oi
+        self.prompts = prompts
+        self.protocol = protocol
+        self.decoder = StreamDecoder(cn.encoding)
+        self.metrics = SessionMetrics(cn, oi.metrics or oi.metrics_sessions is not None)
+        self.stream = None
+        self.pool = None
+        self.client = None
+        self.wf = None
+        self.prompt_list = None
+        # Prompts and platform learned from the host.(--prompt_cache)
+        self.prompt_profile = None
+        self.prompt_matcher = None
+        self.profile = None
+        self.pager_window = 1
+        # Learn the response time of the device.
+        self.idle_timeout = AdaptiveIdleTimeout()
+        # Completion of the last command.("prompt", "password", "confirm", or "eof")
+        self.completion = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self, commands: List[Tuple[str, Dict[str, str]]] = []) -> List[Tuple[str, Dict[str, str]]]:
+        """
+        Connect and login, and open the log file.
+
+        For telnet without username and password, the first commands are the username and the password.
+        Return the rest of commands, with the pager-disable commands of the platform before them.
+        """
+        self.prompt_profile = load_prompt_profile(self.cn)
+        if self.protocol == "ssh":
+            current_output_log = self.connect_ssh()
+        else:
+            current_output_log, commands = self.connect_telnet(commands)
+        self.metrics.logged_in()
 
-#   decoded_prompts = [decode(_) for _ in prompts]
-    prompt_list = detect_prompt_string(current_output_log[-1])
-    while prompt_list is None:
-        decoded_current_output = telnet_read_eager(tn, None, None, enable_removeLF=True)
-        prompt_list = detect_prompt_string(decoded_current_output)
+        self.prompt_matcher = PromptMatcher(self.prompt_list)
 
-    other_prompt_Regulars = [".*[Pp]assword: .*", ".*]: $", ".*--[Mm]ore--.*", ".*--続きます--.*", "--続ける--"]
+        # Disable paging of the platform.
+        self.profile = learn_platform_profile(self.cn, "".join(current_output_log), self.prompt_list, self.prompt_profile)
+        commands = inject_pager_off_commands(self.profile, commands)
+        self.pager_window = get_pager_window(self.cn, self.profile)
 
-    if disable_log_output == False:
-        # logfile open.
-        wf = open(set_output_filename(prompt_list [0], cn, logdir_path), mode='wt')
+        if self.oi.disable_log_output == False:
+            # logfile open.
+            self.wf = open_log_writer(self.prompt_list[0], self.cn, self.oi, string_remove=self.stream.string_remove, decoder=self.decoder)
 
-        # Write responseLog to file.
-        for buf in current_output_log:
-            wf.write(buf.replace("\n", ""))
+            # Write current_output_log to file.
+            for buf in current_output_log:
+                self.wf.write(buf)
+        # The output is not kept after the login.(only the tail is kept for the prompt detection)
         current_output_log = None
-    else:
-        wf = None
 
-    # Dealing with unread material.
-    while True:
-        if tn.eof:
-            break
-        decoded_current_output = telnet_read_eager(tn, wf, None, enable_removeLF=True)
-        if len(decoded_current_output) <= 0:
-            break
+        # Dealing with unread material.
+        self.read_unread(0)
+        return commands
 
-    line_count = 0
-    for line in lines:
-        # Delete comment section.
-        line = re.sub('#.*\n', "", line)
-        line = re.sub('//.*\n', "", line)
-        line = line.rstrip()
+    def connect_telnet(self, commands: List[Tuple[str, Dict[str, str]]]) -> (OutputLog, List[Tuple[str, Dict[str, str]]]):
+        """
+        Start TELNET connection, and wait for the prompt.
+        """
+        try:
+            if self.cn.username != "" or self.cn.passwd != "":
+                tn, current_output_log = connect_telnet_from_connectionInformation(self.cn, self.prompts, self.decoder, self.metrics)
+            else:
+                tn, current_output_log, commands = connect_telnet_from_lines(self.cn, commands, self.prompts, self.decoder, self.metrics)
+        except EOFError:
+            raise ConnectionError("loggin failed to {0}".format(self.cn.ipaddr))
+        self.stream = TelnetStream(tn)
+
+        self.prompt_list, candidate = detect_login_prompt(current_output_log[-1], self.prompt_profile)
+        while self.prompt_list is None:
+            current_output = self.stream.read_some(self.cn.timeout * 5 if candidate is None else self.cn.timeout)
+            if current_output is None and candidate is not None:
+                # The host shows another prompt than the learned one.
+                self.prompt_list = candidate
+                break
+            if current_output is None or self.stream.eof:
+                raise ConnectionError("no prompt from {0}".format(self.cn.ipaddr))
+            decoded_current_output = self.decoder.decode(current_output)
+            print_and_write(decoded_current_output, None, None, string_remove="\n")
+            self.prompt_list, candidate = detect_login_prompt(decoded_current_output, self.prompt_profile)
+        return current_output_log, commands
+
+    def connect_ssh(self) -> OutputLog:
+        """
+        Start SSH connection, and wait for the prompt.
+        """
+    #   logger = paramiko.util.logging.getLogger()
+    #   paramiko.util.log_to_file("./log/paramiko_" + datetime.datetime.now().strftime('_%Y%m%d_%H%M%S') + ".log")
+        self.pool = ssh_pool if ssh_pool is not None else SSHConnectionPool()
+        # The TCP connection is retried by ConnectionManager.
+        client = None
+        try:
+            client = self.pool.acquire(self.cn)
+            channel = client.invoke_shell()
+        except ConnectionError:
+            raise
+        except Exception:
+            if client is not None:
+                self.pool.release(self.cn, client, reuse=False)
+            raise ConnectionError("loggin failed to {0}".format(self.cn.ipaddr))
+        self.client = client
+        self.stream = SSHShellStream(channel)
+        self.metrics.connected()
+
+        current_output_log = OutputLog()
+        candidate = None
+        while self.prompt_list is None:
+            current_output = self.stream.read_some(self.cn.timeout * 5 if candidate is None else self.cn.timeout)
+            if current_output is None and candidate is not None:
+                # The host shows another prompt than the learned one.
+                self.prompt_list = candidate
+                break
+            if current_output is None or self.stream.eof:
+                raise ConnectionError("no prompt from {0}".format(self.cn.ipaddr))
+            decoded_current_output = self.decoder.decode(current_output)
+            self.prompt_list, candidate = detect_login_prompt(decoded_current_output, self.prompt_profile)
+            print_and_write(decoded_current_output, None, current_output_log, string_remove="")
+        return current_output_log
+
+    def read_unread(self, timeout: float):
+        """
+        Write the output received after the last prompt, until no output arrives for timeout seconds.
+        """
+        while not self.stream.eof:
+            current_output = self.stream.read_some(timeout)
+            if current_output is None or len(current_output) <= 0:
+                break
+            print_and_write_bytes(current_output, self.decoder, self.wf, None, string_remove=self.stream.string_remove)
 
-        if line_count == 0:
-            if len(line) == 0:
-                continue
-            if ":" in line:
-                line_count += 1
-                continue
+    def run(self, line: str, options: Dict[str, str] = {}, decode_all: bool = True):
+        """
+        Send the command, and yield the decoded output until the prompt.
 
+        If decode_all is False, the raw log with --quiet decodes only the last line.(the yielded output is the tail)
+
+        "--More--" is answered, and a newline is sent if the prompt does not come until the idle timeout.
+        The completion of the command is set to self.completion.
+        If the iteration is stopped early(close of the generator), the output is read without yielding
+        until the prompt or the deadline, so that the next command starts after the prompt.
+        """
+        step = CommandStep(line, options, self.prompt_matcher, self.idle_timeout, self.pager_window, self.metrics, self.wf, self.completion)
         # command send.
-        tn.write(line.encode() + b"\n")
-        line_count += 1
+        self.stream.write(step.begin())
 
-        decoded_current_output = ""
-        last_decoded_current_output = None
+        abandoned = False
+        try:
+            while not step.done:
+                if self.stream.eof:
+                    break
 
-        # set command execution start time.
-        last_command_send_time = time.time()
+                current_output = self.stream.read_some(step.get_deadline() - time.time())
+                if current_output is None and abandoned:
+                    step.completion = "timeout"
+                    break
+                if current_output is None:
+                    self.stream.write(step.expired())
+                    continue
+                if len(current_output) <= 0:
+                    break
+                step.received(len(current_output))
 
-        while True:
-            if tn.eof:
+                decoded_current_output = print_and_write_bytes(current_output, self.decoder, self.wf, None, string_remove=self.stream.string_remove, decode_all=decode_all)
+
+                if len(decoded_current_output) <= 0:
+                    continue
+                if not abandoned:
+                    try:
+                        yield decoded_current_output
+                    except GeneratorExit:
+                        # The caller stopped the iteration, read on to the prompt.
+                        abandoned = True
+
+                sendBytes = step.feed(decoded_current_output)
+                if len(sendBytes) > 0:
+                    self.stream.write(sendBytes)
+        finally:
+            self.completion = step.finish()
+
+    def run_commands(self, commands: List[Tuple[str, Dict[str, str]]]):
+        """
+        Execute the commands.(pipelined if cn.pipeline > 1 and paging is disabled)
+        """
+        if self.cn.pipeline > 1:
+            if is_paging_disabled(self.profile, commands):
+                self.run_pipelined(commands)
+                return
+            print("\npipeline is not used, because paging of {0} is not disabled".format(self.cn.ipaddr))
+        for line, options in skip_blank_commands(commands):
+            for _ in self.run(line, options, decode_all=False):
+                pass
+
+    def run_pipelined(self, commands: List[Tuple[str, Dict[str, str]]]):
+        """
+        Execute the commands with CommandPipeline.
+        """
+        pipeline = CommandPipeline(commands, self.prompt_list, self.cn.pipeline, self.pager_window, self.metrics, self.wf)
+        last_receive_time = time.time()
+        self.stream.write(pipeline.send_ahead().encode())
+        while not pipeline.done():
+            if self.stream.eof:
                 break
 
-            try:
-                decoded_current_output = telnet_read_eager(tn, wf, None, enable_removeLF=True)
-            except:
+            current_output = self.stream.read_some(pipeline.get_deadline(self.idle_timeout, last_receive_time) - time.time())
+            if current_output is None:
+                # If no prompt was found until the deadline, send a newline.
+                self.stream.write(pipeline.expired().encode())
+                self.idle_timeout.expired()
+                last_receive_time = time.time()
+                continue
+            if len(current_output) <= 0:
                 break
 
-            if len(decoded_current_output) <= 0:
-                if time.time() - last_command_send_time > 2.0:
-                    # If one second has passed from the start of command execution, go to the next command
-                    tn.write(b"\r\n")
-                    last_command_send_time = time.time()
-                else:
-                    time.sleep(0.1)
-                    continue
+            now = time.time()
+            self.idle_timeout.observe(now - last_receive_time)
+            last_receive_time = now
 
-            if "\n" in decoded_current_output:
-                last_decoded_current_output = decoded_current_output.split("\n")[-1]
-            else:
-                if last_decoded_current_output is None:
-                    last_decoded_current_output = decoded_current_output
-                elif last_decoded_current_output == "":
-                    last_decoded_current_output = decoded_current_output
-                else:
-                    last_decoded_current_output += decoded_current_output
+            decoded_current_output = print_and_write_bytes(current_output, self.decoder, self.wf, None, string_remove=self.stream.string_remove, decode_all=True)
+            sendString = pipeline.feed(decoded_current_output, len(current_output))
+            if len(sendString) > 0:
+                self.stream.write(sendString.encode())
+        pipeline.finish()
 
-            if last_decoded_current_output is not None:
+    def close(self):
+        """
+        Write the rest of the output, and close the log file and the connection.
+        """
+        try:
+            if self.stream is not None and self.prompt_matcher is not None:
+                # Dealing with unread material.
+                self.read_unread(self.stream.unread_timeout)
+        finally:
+            if self.wf is not None:
+                self.wf.close()
+            if self.prompt_matcher is not None:
+                finish_session_metrics(self.metrics, self.wf, self.oi)
+            if self.stream is not None:
+                try:
+                    self.stream.close()
+                except:
+                    pass
+            if self.client is not None:
+                self.pool.release(self.cn, self.client)
+            self.wf = None
+            self.prompt_matcher = None
+            self.stream = None
+            self.client = None
+
+def cmdlist_exec_telnet(commands: List[Tuple[str, Dict[str, str]]], cn: ConnectionInformation, prompts: List[bytes], oi: OutputInformation):
+    """
+    Execute command list(TELNET)
+    """
+    with Session(cn, oi, prompts, "telnet") as session:
+        session.run_commands(session.connect(commands))
 
-                if match_prompt_list(last_decoded_current_output, prompt_list):
-                    # If it matches any of the prompt candidate strings.
-                    break
+def cmdlist_exec_ssh(commands: List[Tuple[str, Dict[str, str]]], cn: ConnectionInformation, prompts: List[bytes], oi: OutputInformation):
+    """
+    Execute command list(SSH)
+    """
+    with Session(cn, oi, prompts, "ssh") as session:
+        session.run_commands(session.connect(commands))
 
-                index = lastline_pattern_match(last_decoded_current_output, other_prompt_Regulars)
+def ssh_exec_command(client: paramiko.SSHClient, line: str, options: Dict[str, str]) -> (bytes, int, float, float):
+    """
+    Execute one command on a new exec channel,
+    and return the output, the exit status, the send time and the time to the first byte.
 
-                if index == 0:
-                    """
-                    match ".*[Pp]assword: .*"
-                    """
-                    break
+    stderr is merged into the output, and the exit status is -1 on timeout or channel failure.
+    """
+    first_byte_time = None
+    send_time = time.time()
+    chunks = []
+    exit_status = -1
+    stream = None
+    try:
+        stream = SSHShellStream(client.get_transport().open_session())
+        stream.channel.set_combine_stderr(True)
+        stream.channel.exec_command(line)
 
-                if index == 1:
-                    """
-                    match ".*]: $"
+        # The timeout is the idle time between the outputs.(without #@timeout, the longest idle timeout of the shell)
+        timeout = float(options["timeout"]) if "timeout" in options else AdaptiveIdleTimeout().maximum
+        while True:
+            current_output = stream.read_some(timeout)
+            if current_output is None:
+                break
+            if len(current_output) <= 0:
+                exit_status = stream.channel.recv_exit_status()
+                break
+            if first_byte_time is None:
+                first_byte_time = time.time() - send_time
+            chunks.append(current_output)
+    except (paramiko.SSHException, OSError) as e:
+        print("\n{0}: {1}".format(line, e))
+    finally:
+        if stream is not None:
+            stream.close()
+    return b"".join(chunks), exit_status, send_time, first_byte_time
+
+def print_exec_result(prompt_str: str, line: str, current_output: bytes, exit_status: int, decoder: StreamDecoder, wf: object):
+    """
+    Write the result of exec channel in the same format as the shell.
+    """
+    if wf is not None:
+        wf.begin_section(line)
+    print_and_write(prompt_str + line + "\n", wf, None, string_remove="\r")
+    decoded_current_output = print_and_write_bytes(current_output, decoder, wf, None, string_remove="\r")
+    if len(decoded_current_output) > 0 and decoded_current_output[-1] != "\n":
+        print_and_write("\n", wf, None, string_remove="\r")
+    if exit_status != 0:
+        print_and_write("[exit status {0}]\n".format(exit_status), wf, None, string_remove="\r")
+    if wf is not None:
+        wf.end_section("exit" if exit_status >= 0 else "timeout")
 
-                    Example1)
-                    last_decoded_current_output ... "How many bits in the modulus [512]: "
+def cmdlist_exec_ssh_exec(commands: List[Tuple[str, Dict[str, str]]], cn: ConnectionInformation, oi: OutputInformation):
+    """
+    Execute command list(SSH, exec channel)
 
-                    Example2)
-                    last_decoded_current_output ... "% Do you really want to replace them? [yes/no]: "
-                    """
-                    break
+    Each command runs on its own exec channel without prompt detection.
+    Up to cn.parallel commands run at the same time on one connection,
+    and the output is written in the order of the command list.
+    """
+    decoder = StreamDecoder(cn.encoding)
+    metrics = SessionMetrics(cn, oi.metrics or oi.metrics_sessions is not None)
 
-                elif index >= 2:
-                    """
-                    repeat send space for "--More--".
-                    """
-                    # Send Space.
-                    tn.write(b" ")
-                    last_command_send_time = time.time()
-                    continue
-            pass
+    # Start SSH connection
+    pool = ssh_pool if ssh_pool is not None else SSHConnectionPool()
+    # The TCP connection is retried by ConnectionManager.
+    try:
+        client = pool.acquire(cn)
+    except ConnectionError:
+        raise
+    except Exception:
+        raise ConnectionError("loggin failed to {0}".format(cn.ipaddr))
+    metrics.connected()
+    metrics.logged_in()
+
+    prompt_str = "{0}@{1}$ ".format(cn.username, cn.ipaddr)
+    if oi.disable_log_output == False:
+        # logfile open.
+        wf = open_log_writer(prompt_str, cn, oi, string_remove="\r", decoder=decoder)
+    else:
+        wf = None
 
-    # Dealing with unread material.
-    while True:
-        if tn.eof:
-            break
-        try:
-            decoded_current_output = telnet_read_eager(tn, wf, None, enable_removeLF=True)
-            if len(decoded_current_output) <= 0:
+    commands = [(line, options) for line, options in commands if len(line) > 0]
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=cn.parallel) as executor:
+            futures = [executor.submit(ssh_exec_command, client, line, options) for line, options in commands]
+            for (line, _), future in zip(commands, futures):
+                current_output, exit_status, send_time, first_byte_time = future.result()
+                metrics.add_command(line, send_time, first_byte_time, time.time() - send_time, len(current_output), 0, "exit" if exit_status >= 0 else "timeout")
+                print_exec_result(prompt_str, line, current_output, exit_status, decoder, wf)
+    finally:
+        close_session_log(wf, metrics, oi)
+        pool.release(cn, client)
+
+class AsyncTelnetStream:
+    """
+    TELNET on asyncio streams.
+    Like telnetlib without option callback, every option negotiation is refused.
+    """
+    IAC = 255
+    DONT = 254
+    DO = 253
+    WONT = 252
+    WILL = 251
+    SB = 250
+    SE = 240
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.eof = False
+        self.iacseq = b""
+        self.cookedq = b""
+        self.string_remove = "\n"
+        # The output after the last prompt is read without waiting.
+        self.unread_timeout = 0
+
+    def process_raw(self, data: bytes) -> bytes:
+        """
+        Remove TELNET commands from received data, and refuse option negotiations.
+        """
+        buf = self.iacseq + data
+        self.iacseq = b""
+        cooked = bytearray()
+        i = 0
+        while i < len(buf):
+            pos = buf.find(self.IAC, i)
+            if pos < 0:
+                cooked += buf[i:]
                 break
-        except:
-            break
-
-    if tn is not None:
+            cooked += buf[i:pos]
+            if pos + 1 >= len(buf):
+                self.iacseq = buf[pos:]
+                break
+            cmd = buf[pos + 1]
+            if cmd == self.IAC:
+                cooked.append(self.IAC)
+                i = pos + 2
+            elif cmd in (self.DO, self.DONT, self.WILL, self.WONT):
+                if pos + 2 >= len(buf):
+                    self.iacseq = buf[pos:]
+                    break
+                if cmd == self.DO:
+                    self.writer.write(bytes([self.IAC, self.WONT, buf[pos + 2]]))
+                elif cmd == self.WILL:
+                    self.writer.write(bytes([self.IAC, self.DONT, buf[pos + 2]]))
+                i = pos + 3
+            elif cmd == self.SB:
+                end = buf.find(bytes([self.IAC, self.SE]), pos + 2)
+                if end < 0:
+                    self.iacseq = buf[pos:]
+                    break
+                i = end + 2
+            else:
+                i = pos + 2
+        return bytes(cooked).replace(b"\0", b"").replace(b"\021", b"")
+
+    async def read_some(self, timeout: float) -> bytes:
+        """
+        Read received data.
+        return None on timeout, b"" on EOF.
+        """
+        if len(self.cookedq) > 0:
+            data, self.cookedq = self.cookedq, b""
+            return data
+        deadline = time.time() + timeout
+        while True:
+            try:
+                data = await asyncio.wait_for(self.reader.read(65536), max(deadline - time.time(), 0.001))
+            except asyncio.TimeoutError:
+                return None
+            except OSError:
+                data = b""
+            if len(data) == 0:
+                self.eof = True
+                return b""
+            data = self.process_raw(data)
+            if len(data) > 0:
+                return data
+
+    async def expect(self, patterns: List[bytes], timeout: float) -> (int, object, bytes):
+        """
+        Read until one of the patterns matches, like telnetlib.Telnet.expect().
+        """
+        compiled_patterns = [re.compile(_) for _ in patterns]
+        buf = b""
+        deadline = time.time() + timeout
+        while True:
+            for i, pattern in enumerate(compiled_patterns):
+                m = pattern.search(buf)
+                if m is not None:
+                    self.cookedq = buf[m.end():]
+                    return i, m, buf[:m.end()]
+            if self.eof:
+                return -1, None, buf
+            data = await self.read_some(deadline - time.time())
+            if data is None:
+                return -1, None, buf
+            buf += data
+
+    def write(self, buffer: bytes):
+        self.writer.write(buffer.replace(bytes([self.IAC]), bytes([self.IAC, self.IAC])))
+
+    def close(self):
+        self.writer.close()
+
+class AsyncSSHStream:
+    """
+    Interactive shell of asyncssh with the same interface as AsyncTelnetStream.
+    """
+    def __init__(self, conn: object, process: object):
+        self.conn = conn
+        self.process = process
+        self.eof = False
+        self.string_remove = "\r"
+        # Wait a little for the output after the last prompt.
+        self.unread_timeout = 0.5
+
+    async def read_some(self, timeout: float) -> bytes:
+        """
+        Read received data.
+        return None on timeout, b"" on EOF.
+        """
         try:
-            tn.close()
-        except:
-            pass
-
-    if wf is not None:
-        wf.close()
+            data = await asyncio.wait_for(self.process.stdout.read(65536), max(timeout, 0.001))
+        except asyncio.TimeoutError:
+            return None
+        except (OSError, asyncssh.Error):
+            data = b""
+        if len(data) == 0:
+            self.eof = True
+        return data
+
+    def write(self, buffer: bytes):
+        self.process.stdin.write(buffer)
+
+    def close(self):
+        self.process.close()
+        self.conn.close()
+
+def open_log_writer_async(prompt_str: str, cn: ConnectionInformation, oi: OutputInformation, string_remove: str, decoder: StreamDecoder) -> LogWriter:
+    """
+    open_log_writer() whose write never waits for the writer thread on the event loop.(asyncio)
+    """
+    wf = open_log_writer(prompt_str, cn, oi, string_remove=string_remove, decoder=decoder)
+    if isinstance(wf, LogWriter):
+        wf.blocking = False
+    return wf
 
-    return
+async def drain_log_writer(wf: object):
+    """
+    If the writer thread is behind, wait for it in a worker thread,
+    so that slow storage throttles the session without blocking the event loop.(asyncio)
+    """
+    if isinstance(wf, LogWriter) and len(wf.buffer) >= wf.buffer_size * 16:
+        await asyncio.get_running_loop().run_in_executor(None, wf.flush)
 
-def cmdlist_exec_ssh(lines: List[str], cn: ConnectionInformation, prompts: List[bytes], disable_log_output: bool, logdir_path: str):
+async def close_session_log_async(wf: object, metrics: SessionMetrics, oi: OutputInformation):
     """
-    Execute command list(SSH)
+    close_session_log() in a worker thread, because it waits for the writer thread and the store.(asyncio)
     """
-#   logger = paramiko.util.logging.getLogger()
-#   paramiko.util.log_to_file("./log/paramiko_" + datetime.datetime.now().strftime('_%Y%m%d_%H%M%S') + ".log")
+    await asyncio.get_running_loop().run_in_executor(None, close_session_log, wf, metrics, oi)
 
-    # Start SSH connection
-    error_count = 0
-    while True:
+def raise_open_files_limit():
+    """
+    Raise the soft limit of open files up to the hard limit, for thousands of sessions.(POSIX only)
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        hard = 65536
+    if soft < hard:
         try:
-            client = paramiko.SSHClient()
-        #   client.set_missing_host_key_policy(paramiko.WarningPolicy())
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            client.connect(cn.ipaddr, username = cn.username, password = cn.passwd)
-            ssh_shell = client.invoke_shell()
-        except:
-            error_count += 1
-            if error_count >= 3:
-                exit(0)
-        else:
-            break
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
 
-    current_output_log = []
-    prompt_list = None
+async def cmdlist_exec_file_async(cmdlist_file_path: str, oi: OutputInformation, plan_cache_dir: str = "") -> bool:
+    """
+    Execute one command list file.(asyncio)
+    """
+    # read command list file.
+    plan = load_cmdlist_plan(cmdlist_file_path, plan_cache_dir)
+    if plan is None:
+        print("read failed {0}".format(cmdlist_file_path))
+        return False
+    return await cmdlist_exec_plan_async(plan, oi)
 
-    while prompt_list is None:
-        if ssh_shell.recv_ready():
-            current_output = ssh_shell.recv(65536 * 10)
-            decoded_current_output = decode(current_output)
-            prompt_list = detect_prompt_string(decoded_current_output)
-            print_and_write(decoded_current_output, None, current_output_log, string_remove="")
+async def cmdlist_exec_plan_async(plan: CmdlistPlan, oi: OutputInformation) -> bool:
+    """
+    Execute one parsed command list file.(asyncio)
+    """
+    prompts = standby_prompts
 
-    other_prompt_Regulars = [".*[Pp]assword: .*", ".*]: $", ".*--[Mm]ore--.*", ".*--続きます--.*", ".*--続ける--.*"]
+    cn, commands = prepare_plan(plan)
+    if cn is None:
+        return False
 
-    if disable_log_output == False:
-        # logfile open.
-        wf = open(set_output_filename(prompt_list[0], cn, logdir_path), mode='wt')
+    # Execute command list.
+    if cn.port == "22":
+        # SSH
+        if cn.ssh_mode == "exec":
+            await cmdlist_exec_ssh_exec_async(commands, cn, oi)
+        else:
+            await cmdlist_exec_ssh_async(commands, cn, oi)
+    else:
+        # TELNET
+        await cmdlist_exec_telnet_async(commands, cn, prompts, oi)
+    return True
 
-        # Write current_output_log to file.
-        for buf in current_output_log:
-            wf.write(buf.replace("\r", ""))
-        current_output_log = None
+async def cmdlist_exec_fleet_plans_async(plans: List[CmdlistPlan], workers: int, per_host: int, oi: OutputInformation) -> List[FleetResult]:
+    """
+    Execute many parsed command list files concurrently in one event loop.
+    """
+    raise_open_files_limit()
+    workers_semaphore = asyncio.Semaphore(workers)
+    host_semaphores = {}
+
+    async def fleet_session(plan: CmdlistPlan) -> FleetResult:
+        async with host_semaphores[plan.ipaddr]:
+            async with workers_semaphore:
+                start_time = time.time()
+                success = False
+                message = ""
+                try:
+                    success = await cmdlist_exec_plan_async(plan, oi)
+                    if not success:
+                        message = "invalid command list file"
+                except Exception as e:
+                    message = "{0}: {1}".format(type(e).__name__, e)
+                return FleetResult(plan.filename, plan.ipaddr, success, time.time() - start_time, message)
+
+    sessions = []
+    for plan in plans:
+        if plan.ipaddr not in host_semaphores:
+            host_semaphores[plan.ipaddr] = asyncio.Semaphore(per_host)
+        sessions.append(fleet_session(plan))
+
+    return list(await asyncio.gather(*sessions))
+
+async def connect_telnet_async(cn: ConnectionInformation, commands: List[Tuple[str, Dict[str, str]]], prompts: List[bytes], decoder: StreamDecoder, metrics: SessionMetrics) -> (AsyncTelnetStream, List[str], List[Tuple[str, Dict[str, str]]]):
+    """
+    Start telnet connection, and login with the connection information or the command list.(asyncio)
+    """
+    current_output_log = OutputLog()
+    manager = connection_manager if connection_manager is not None else ConnectionManager()
+    reader, writer = await asyncio.open_connection(sock=await manager.connect_async(cn))
+    tn = AsyncTelnetStream(reader, writer)
+    metrics.connected()
 
-    else:
-        wf = None
+    if cn.username != "" or cn.passwd != "":
+        if cn.username != "":
+            # Wait for username prompt, and send username.
+            _, _, current_output = await tn.expect([b": "], cn.timeout)
+            print_and_append(current_output_log, decoder.decode(current_output))
+            tn.write(cn.username.encode() + b"\n")
+            print_and_append(current_output_log, cn.username + "\n")
+
+        # Wait for password prompt, and send password.
+        _, _, current_output = await tn.expect([b": "], cn.timeout)
+        print_and_append(current_output_log, decoder.decode(current_output))
+        tn.write(cn.passwd.encode() + b"\n")
+        print_and_append(current_output_log, cn.passwd + "\n")
 
-    # Dealing with unread material.
-    while ssh_shell.recv_ready():
-        current_output = ssh_shell.recv(65536 * 10)
-        decoded_current_output = decode(current_output)
-        print_and_write(decoded_current_output, wf, current_output_log, string_remove="\r")
+        # Wait for prompt.
+        _, _, current_output = await tn.expect(prompts, 4)
+        print_and_append(current_output_log, decoder.decode(current_output))
+        return tn, current_output_log, commands
 
-    line_count = 0
-    last_decoded_current_output = None
-    for line in lines:
-        # Delete comment section.
-        line = re.sub('#.*\n', "", line)
-        line = re.sub('//.*\n', "", line)
-        line = line.rstrip()
+    _, _, current_output = await tn.expect(prompts, 4)
+    print_and_append(current_output_log, decoder.decode(current_output))
 
-        if line_count == 0:
-            if len(line) == 0:
-                continue
-            if ":" in line:
-                line_count += 1
-                continue
+    i = -1
+    for i, (line, _) in enumerate(commands[:2]):
+        # Send username or password, and wait for prompt.
+        tn.write(line.encode() + b"\n")
+        index, _, current_output = await tn.expect(prompts, 4)
+        print_and_append(current_output_log, decoder.decode(current_output))
 
-        # command send.
-    #   interact.send(line)
-        ssh_shell.send(line + "\n")
-        line_count += 1
+        if index >= 0 and index < 8:
+            break
+        if i == 1:
+            tn.close()
+            raise ConnectionError("loggin failed to {0}".format(cn.ipaddr))
 
-        # set command execution start time.
-        last_command_send_time = time.time()
+    return tn, current_output_log, skip_blank_commands(commands[i + 1:])
 
-        while True:
-            # repeat send space for "--More--".
-            if ssh_shell.closed:
+async def cmdlist_exec_telnet_async(commands: List[Tuple[str, Dict[str, str]]], cn: ConnectionInformation, prompts: List[bytes], oi: OutputInformation):
+    """
+    Execute command list(TELNET, asyncio)
+    """
+    decoder = StreamDecoder(cn.encoding)
+    metrics = SessionMetrics(cn, oi.metrics or oi.metrics_sessions is not None)
+    prompt_profile = load_prompt_profile(cn)
+    tn, current_output_log, commands = await connect_telnet_async(cn, commands, prompts, decoder, metrics)
+
+    try:
+        prompt_list, candidate = detect_login_prompt(current_output_log[-1], prompt_profile)
+        while prompt_list is None:
+            current_output = await tn.read_some(cn.timeout * 5 if candidate is None else cn.timeout)
+            if current_output is None and candidate is not None:
+                # The host shows another prompt than the learned one.
+                prompt_list = candidate
                 break
+            if current_output is None or tn.eof:
+                raise ConnectionError("no prompt from {0}".format(cn.ipaddr))
+            decoded_current_output = decoder.decode(current_output)
+            print_and_write(decoded_current_output, None, None, string_remove="\n")
+            prompt_list, candidate = detect_login_prompt(decoded_current_output, prompt_profile)
+        metrics.logged_in()
+
+        await cmdlist_exec_commands_async(tn, decoder, commands, cn, prompt_list, current_output_log, oi, metrics, prompt_profile)
+    finally:
+        tn.close()
+
+async def cmdlist_exec_ssh_async(commands: List[Tuple[str, Dict[str, str]]], cn: ConnectionInformation, oi: OutputInformation):
+    """
+    Execute command list(SSH, asyncio)
+    """
+    if asyncssh is None:
+        raise ConnectionError("asyncssh is required for ssh with asyncio engine.(pip install asyncssh)")
 
-            if ssh_shell.recv_ready() == False:
-                if time.time() - last_command_send_time > 2.0:
-                    # If one second has passed from the start of command execution, go to the next command
-                    ssh_shell.send("\r\n")
-                    last_command_send_time = time.time()
-                else:
-                    time.sleep(0.1)
-                    continue
+    decoder = StreamDecoder(cn.encoding)
+    metrics = SessionMetrics(cn, oi.metrics or oi.metrics_sessions is not None)
 
-            current_output = ssh_shell.recv(65536 * 10)
-            decoded_current_output = decode(current_output)
-            print_and_write(decoded_current_output, wf, current_output_log, string_remove="\r")
+    manager = connection_manager if connection_manager is not None else ConnectionManager()
+    sock = await manager.connect_async(cn)
+    try:
+        conn = await asyncio.wait_for(asyncssh.connect(cn.ipaddr, int(cn.port), username=cn.username, password=cn.passwd, known_hosts=None, sock=sock),
+                                      cn.timeout * 5)
+        process = await conn.create_process(term_type="vt100", encoding=None)
+    except (OSError, asyncio.TimeoutError, asyncssh.Error):
+        raise ConnectionError("connect failed to {0}".format(cn.ipaddr))
+    ssh_shell = AsyncSSHStream(conn, process)
+    metrics.connected()
 
-            if len(decoded_current_output) <= 0:
-                continue
+    try:
+        prompt_profile = load_prompt_profile(cn)
+        current_output_log = OutputLog()
+        prompt_list = None
+        candidate = None
+        while prompt_list is None:
+            current_output = await ssh_shell.read_some(cn.timeout * 5 if candidate is None else cn.timeout)
+            if current_output is None and candidate is not None:
+                # The host shows another prompt than the learned one.
+                prompt_list = candidate
+                break
+            if current_output is None or ssh_shell.eof:
+                raise ConnectionError("no prompt from {0}".format(cn.ipaddr))
+            decoded_current_output = decoder.decode(current_output)
+            prompt_list, candidate = detect_login_prompt(decoded_current_output, prompt_profile)
+            print_and_write(decoded_current_output, None, current_output_log, string_remove="")
+        metrics.logged_in()
 
-            if "\n" in decoded_current_output:
-                last_decoded_current_output = decoded_current_output.split("\n")[-1]
-            else:
-                if last_decoded_current_output is None:
-                    last_decoded_current_output = decoded_current_output
-                elif last_decoded_current_output == "":
-                    last_decoded_current_output = decoded_current_output
-                else:
-                    last_decoded_current_output += decoded_current_output
+        await cmdlist_exec_commands_async(ssh_shell, decoder, commands, cn, prompt_list, current_output_log, oi, metrics, prompt_profile)
+    finally:
+        ssh_shell.close()
 
-            if last_decoded_current_output is not None:
-                if len(last_decoded_current_output) <= 0:
-                    continue
+async def cmdlist_exec_ssh_exec_async(commands: List[Tuple[str, Dict[str, str]]], cn: ConnectionInformation, oi: OutputInformation):
+    """
+    Execute command list(SSH exec channel, asyncio)
+    """
+    if asyncssh is None:
+        raise ConnectionError("asyncssh is required for ssh with asyncio engine.(pip install asyncssh)")
 
-                if match_prompt_list(last_decoded_current_output, prompt_list):
-                    # If it matches any of the prompt candidate strings.
-                    break
+    decoder = StreamDecoder(cn.encoding)
+    metrics = SessionMetrics(cn, oi.metrics or oi.metrics_sessions is not None)
+
+    manager = connection_manager if connection_manager is not None else ConnectionManager()
+    sock = await manager.connect_async(cn)
+    try:
+        conn = await asyncio.wait_for(asyncssh.connect(cn.ipaddr, int(cn.port), username=cn.username, password=cn.passwd, known_hosts=None, sock=sock),
+                                      cn.timeout * 5)
+    except (OSError, asyncio.TimeoutError, asyncssh.Error):
+        raise ConnectionError("connect failed to {0}".format(cn.ipaddr))
+    metrics.connected()
+    metrics.logged_in()
+
+    semaphore = asyncio.Semaphore(cn.parallel)
+
+    async def exec_command(line: str, options: Dict[str, str]) -> (bytes, int, float):
+        async with semaphore:
+            send_time = time.time()
+            timeout = None
+            if "timeout" in options:
+                timeout = float(options["timeout"])
+            try:
+                result = await conn.run(line, stderr=asyncssh.STDOUT, encoding=None, timeout=timeout)
+            except asyncssh.TimeoutError as e:
+                return e.stdout or b"", -1, send_time
+            except (asyncssh.Error, OSError) as e:
+                print("\n{0}: {1}".format(line, e))
+                return b"", -1, send_time
+            exit_status = result.exit_status
+            if exit_status is None:
+                exit_status = -1
+            return result.stdout or b"", exit_status, send_time
+
+    prompt_str = "{0}@{1}$ ".format(cn.username, cn.ipaddr)
+    if oi.disable_log_output == False:
+        # logfile open.
+        wf = open_log_writer_async(prompt_str, cn, oi, string_remove="\r", decoder=decoder)
+    else:
+        wf = None
 
-                index = lastline_pattern_match(last_decoded_current_output, other_prompt_Regulars)
+    commands = [(line, options) for line, options in commands if len(line) > 0]
+    tasks = [asyncio.ensure_future(exec_command(line, options)) for line, options in commands]
+    try:
+        for (line, _), task in zip(commands, tasks):
+            current_output, exit_status, send_time = await task
+            metrics.add_command(line, send_time, None, time.time() - send_time, len(current_output), 0, "exit" if exit_status >= 0 else "timeout")
+            print_exec_result(prompt_str, line, current_output, exit_status, decoder, wf)
+            await drain_log_writer(wf)
+    finally:
+        for task in tasks:
+            task.cancel()
+        conn.close()
+        await close_session_log_async(wf, metrics, oi)
+
+async def cmdlist_exec_pipelined_async(pipeline: CommandPipeline, stream: object, idle_timeout: AdaptiveIdleTimeout, decoder: StreamDecoder, wf: object, current_output_log: List[str]):
+    """
+    Execute the commands of the pipeline on AsyncTelnetStream or AsyncSSHStream.
+    """
+    last_receive_time = time.time()
+    stream.write(pipeline.send_ahead().encode())
+    while not pipeline.done():
+        if stream.eof:
+            break
 
-                if index == 0:
-                    """
-                    match ".*[Pp]assword: .*"
-                    """
-                    break
+        current_output = await stream.read_some(pipeline.get_deadline(idle_timeout, last_receive_time) - time.time())
+        if current_output is None:
+            # If no prompt was found until the deadline, send a newline.
+            stream.write(pipeline.expired().encode())
+            idle_timeout.expired()
+            last_receive_time = time.time()
+            continue
 
-                if index == 1:
-                    """
-                    match ".*]: $"
+        now = time.time()
+        idle_timeout.observe(now - last_receive_time)
+        last_receive_time = now
 
-                    Example1)
-                    last_decoded_current_output ... "How many bits in the modulus [512]: "
+        decoded_current_output = print_and_write_bytes(current_output, decoder, wf, current_output_log, string_remove=stream.string_remove, decode_all=True)
+        sendString = pipeline.feed(decoded_current_output, len(current_output))
+        if len(sendString) > 0:
+            stream.write(sendString.encode())
+        await drain_log_writer(wf)
+    pipeline.finish()
 
-                    Example2)
-                    last_decoded_current_output ... "% Do you really want to replace them? [yes/no]: "
-                    """
-                    break
+async def cmdlist_exec_commands_async(stream: object, decoder: StreamDecoder, commands: List[Tuple[str, Dict[str, str]]], cn: ConnectionInformation, prompt_list: List[str], current_output_log: List[str], oi: OutputInformation, metrics: SessionMetrics,
+                                      prompt_profile: Dict[str, object] = None):
+    """
+    Execute commands on AsyncTelnetStream or AsyncSSHStream.
+    """
+    prompt_matcher = PromptMatcher(prompt_list)
 
-                elif index >= 2:
-                    """
-                    repeat send space for "--More--".
-                    """
-                    ssh_shell.send(" ")
-                    last_command_send_time = time.time()
+    # Disable paging of the platform.
+    profile = learn_platform_profile(cn, "".join(current_output_log), prompt_list, prompt_profile)
+    commands = inject_pager_off_commands(profile, commands)
+    pager_window = get_pager_window(cn, profile)
 
-    # Dealing with unread material.
-    while True:
-        try:
-            current_output = ssh_shell.recv(65536 * 10)
-            decoded_current_output = decode(current_output)
-            print_and_write(decoded_current_output, wf, current_output_log, string_remove="\r")
-            if len(decoded_current_output) <= 0:
-                break
-        except:
-            break
+    if oi.disable_log_output == False:
+        # logfile open.
+        wf = open_log_writer_async(prompt_list[0], cn, oi, string_remove=stream.string_remove, decoder=decoder)
 
-    if ssh_shell is not None:
-        try:
-            ssh_shell.close()
-        except:
-            pass
+        # Write current_output_log to file.
+        for buf in current_output_log:
+            wf.write(buf)
+    else:
+        wf = None
+    # The output is not kept after the login.(only the tail is kept for the prompt detection)
+    current_output_log = None
 
-    if wf is not None:
-        wf.close()
+    # Learn the response time of the device.
+    idle_timeout = AdaptiveIdleTimeout()
 
-    return
+    try:
+        if cn.pipeline > 1 and not is_paging_disabled(profile, commands):
+            print("\npipeline is not used, because paging of {0} is not disabled".format(cn.ipaddr))
+        elif cn.pipeline > 1:
+            pipeline = CommandPipeline(commands, prompt_list, cn.pipeline, pager_window, metrics, wf)
+            await cmdlist_exec_pipelined_async(pipeline, stream, idle_timeout, decoder, wf, current_output_log)
+            commands = []
+
+        completion = None
+        for line, options in skip_blank_commands(commands):
+            step = CommandStep(line, options, prompt_matcher, idle_timeout, pager_window, metrics, wf, completion)
+            # command send.
+            stream.write(step.begin())
+            try:
+                while not step.done:
+                    if stream.eof:
+                        break
+
+                    current_output = await stream.read_some(step.get_deadline() - time.time())
+                    if current_output is None:
+                        stream.write(step.expired())
+                        continue
+                    if len(current_output) <= 0:
+                        break
+                    step.received(len(current_output))
+
+                    decoded_current_output = print_and_write_bytes(current_output, decoder, wf, current_output_log, string_remove=stream.string_remove)
+                    await drain_log_writer(wf)
+
+                    if len(decoded_current_output) <= 0:
+                        continue
+                    sendBytes = step.feed(decoded_current_output)
+                    if len(sendBytes) > 0:
+                        stream.write(sendBytes)
+            finally:
+                completion = step.finish()
+
+        # Dealing with unread material.
+        while not stream.eof:
+            current_output = await stream.read_some(stream.unread_timeout)
+            if current_output is None or len(current_output) <= 0:
+                break
+            print_and_write_bytes(current_output, decoder, wf, current_output_log, string_remove=stream.string_remove)
+            await drain_log_writer(wf)
+    finally:
+        await close_session_log_async(wf, metrics, oi)
 
 if __name__ == '__main__':
     main()
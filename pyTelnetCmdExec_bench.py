@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+
+"""Overview:
+    Benchmark of pyTelnetCmdExec with local fake telnet/ssh devices.
+Usage:
+    pyTelnetCmdExec_bench.py [--scenario <name>] [--sessions <num>] [--commands <num>] [--lines <num>] [--line_size <num>] [--page_lines <num>] [--delay <sec>] [--output <json_file>] [--baseline <json_file>] [--tolerance <ratio>] [-h|--help]
+
+Options:
+    --scenario <name>        : "telnet", "telnet_paging", "ssh", "ssh_exec" or "all".(default="all")
+                               "telnet_paging" answers "--More--" instead of disabling paging by the platform profile.
+                               "ssh_exec" runs each command on its own exec channel.
+    --sessions <num>         : Number of sessions of each scenario.(default=5)
+    --commands <num>         : Number of commands of each session.(default=20)
+    --lines <num>            : Number of output lines of each command.(default=100)
+    --line_size <num>        : Size of each output line in bytes.(default=80)
+    --page_lines <num>       : Lines of the "--More--" page of the telnet device, 0 disables paging.(default=24)
+    --delay <sec>            : Response delay of the devices for each command.(default=0)
+    --output <json_file>     : Save the results as JSON.
+    --baseline <json_file>   : Compare the results with the saved JSON, and exit 1 on regression.
+    --tolerance <ratio>      : Allowed degradation from the baseline.(default=0.2)
+    -h, --help               : Show this help message and exit.
+"""
+
+import datetime
+import docopt
+import json
+import multiprocessing
+import paramiko
+import platform
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Dict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import pyTelnetCmdExec
+
+class DeviceConfig:
+    def __init__(self, lines, line_size, page_lines, delay):
+        self.lines = lines
+        self.line_size = line_size
+        self.page_lines = page_lines
+        self.delay = delay
+
+    def output_lines(self, cmd: str) -> List[bytes]:
+        """
+        Output of "show bench N" command.
+        """
+        result = []
+        for i in range(self.lines):
+            head = "{0} line {1} ".format(cmd, i)
+            result.append((head + "x" * max(self.line_size - len(head) - 2, 0) + "\r\n").encode())
+        return result
+
+class SessionRecorder:
+    """
+    Arrival time of commands and bytes sent by one device session.
+    """
+    def __init__(self, kind: str, event_queue: multiprocessing.Queue):
+        self.kind = kind
+        self.event_queue = event_queue
+        self.arrivals = []
+        self.bytes_sent = 0
+
+    def command(self, cmd: str):
+        self.arrivals.append((cmd, time.time()))
+
+    def sent(self, buffer: bytes):
+        self.bytes_sent += len(buffer)
+
+    def close(self):
+        self.event_queue.put({"kind": self.kind, "arrivals": self.arrivals, "bytes_sent": self.bytes_sent})
+
+class FakeTelnetHandler(socketserver.StreamRequestHandler):
+    """
+    Cisco-like telnet device.("Router>", "Router#" and "--More--")
+    """
+    def readline(self) -> str:
+        buffer = b""
+        while True:
+            c = self.rfile.read(1)
+            if len(c) == 0:
+                raise EOFError
+            if c == b"\n":
+                return buffer.decode()
+            if c != b"\r":
+                buffer += c
+
+    def send(self, buffer: bytes):
+        self.wfile.write(buffer)
+        self.wfile.flush()
+        self.recorder.sent(buffer)
+
+    def handle(self):
+        # Do not let Nagle's algorithm delay the small writes of the device.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        config = self.server.config
+        self.recorder = SessionRecorder("telnet", self.server.event_queue)
+        try:
+            self.send(b"\r\nUser Access Verification\r\n\r\nPassword: ")
+            self.readline()
+            prompt = b"Router>"
+            self.send(b"\r\n" + prompt)
+            paging = config.page_lines > 0
+            while True:
+                cmd = self.readline().strip()
+                self.recorder.command(cmd)
+                self.send(cmd.encode() + b"\r\n")
+                if cmd in ("exit", "quit"):
+                    return
+                if cmd == "enable":
+                    self.send(b"Password: ")
+                    self.readline()
+                    prompt = b"Router#"
+                elif cmd == "terminal length 0":
+                    paging = False
+                elif cmd.startswith("show"):
+                    time.sleep(config.delay)
+                    for i, line in enumerate(config.output_lines(cmd)):
+                        self.send(line)
+                        if paging and (i + 1) % config.page_lines == 0 and i + 1 < config.lines:
+                            self.send(b" --More-- ")
+                            self.rfile.read(1)
+                            self.send(b"\b" * 10 + b" " * 10 + b"\b" * 10)
+                self.send(b"\r\n" + prompt)
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.recorder.close()
+
+class FakeTelnetServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class FakeSSHServer(paramiko.ServerInterface):
+    """
+    bash-like ssh device.("bench@bench:~$ ")
+    """
+    def __init__(self, config: DeviceConfig, event_queue: multiprocessing.Queue):
+        self.config = config
+        self.event_queue = event_queue
+        # The exec channels of one connection are one session.(closed by "exit")
+        self.exec_recorder = None
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=self.shell, args=(channel,), daemon=True).start()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.exec_command, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    def exec_command(self, channel: paramiko.Channel, cmd: str):
+        if self.exec_recorder is None:
+            self.exec_recorder = SessionRecorder("ssh_exec", self.event_queue)
+        recorder = self.exec_recorder
+        recorder.command(cmd)
+        try:
+            if cmd.startswith("show"):
+                time.sleep(self.config.delay)
+                for line in self.config.output_lines(cmd):
+                    channel.sendall(line)
+                    recorder.sent(line)
+            channel.send_exit_status(0)
+            channel.shutdown_write()
+            # This thread may run before the reply of the exec request is sent, and the client fails with "Channel closed"
+            # if the channel is closed before the reply. So the channel is closed by the client after EOF.(or after 1 second)
+            channel.settimeout(1.0)
+            while len(channel.recv(4096)) > 0:
+                pass
+        except OSError:
+            pass
+        finally:
+            channel.close()
+            if cmd == "exit":
+                self.exec_recorder = None
+                recorder.close()
+
+    def shell(self, channel: paramiko.Channel):
+        recorder = SessionRecorder("ssh", self.event_queue)
+        prompt = b"bench@bench:~$ "
+
+        def send(buffer: bytes):
+            channel.sendall(buffer)
+            recorder.sent(buffer)
+
+        try:
+            send(b"Welcome to bench\r\n\r\n" + prompt)
+            buffer = b""
+            while True:
+                current_input = channel.recv(4096)
+                if len(current_input) == 0:
+                    break
+                buffer += current_input
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    cmd = line.decode().strip()
+                    recorder.command(cmd)
+                    send(cmd.encode() + b"\r\n")
+                    if cmd == "exit":
+                        send(b"logout\r\n")
+                        channel.send_exit_status(0)
+                        return
+                    if cmd.startswith("show"):
+                        time.sleep(self.config.delay)
+                        send(b"".join(self.config.output_lines(cmd)))
+                    send(prompt)
+        except OSError:
+            pass
+        finally:
+            channel.close()
+            recorder.close()
+
+def serve_ssh(sock: socket.socket, config: DeviceConfig, event_queue: multiprocessing.Queue):
+    host_key = paramiko.RSAKey.generate(2048)
+    while True:
+        client, _ = sock.accept()
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(client)
+        transport.add_server_key(host_key)
+        # The key exchange runs in its own thread, so that a slow client does not stall the next connections.
+        threading.Thread(target=transport.start_server, kwargs={"server": FakeSSHServer(config, event_queue)}, daemon=True).start()
+
+def run_devices(config: DeviceConfig, port_queue: multiprocessing.Queue, event_queue: multiprocessing.Queue):
+    """
+    Start the fake devices.(in the child process, so that the CPU time of the client is measured alone)
+    """
+    telnet_server = FakeTelnetServer(("127.0.0.1", 0), FakeTelnetHandler)
+    telnet_server.config = config
+    telnet_server.event_queue = event_queue
+    threading.Thread(target=telnet_server.serve_forever, daemon=True).start()
+
+    ssh_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    ssh_sock.bind(("127.0.0.1", 0))
+    ssh_sock.listen(100)
+    threading.Thread(target=serve_ssh, args=(ssh_sock, config, event_queue), daemon=True).start()
+
+    port_queue.put({"telnet": telnet_server.server_address[1], "telnet_paging": telnet_server.server_address[1],
+                    "ssh": ssh_sock.getsockname()[1], "ssh_exec": ssh_sock.getsockname()[1]})
+    while True:
+        time.sleep(3600)
+
+def create_cmdlist(scenario: str, port: int, commands: int) -> List[str]:
+    """
+    Command list of the scenario.
+    """
+    lines = []
+    if scenario == "telnet":
+        lines.append("127.0.0.1:{0},,\n".format(port))
+        lines += ["bench\n", "enable\n", "bench\n"]
+    elif scenario == "telnet_paging":
+        # The platform profile would send "terminal length 0".
+        lines.append("127.0.0.1:{0},,  #@platform=none\n".format(port))
+        lines += ["bench\n", "enable\n", "bench\n"]
+    elif scenario == "ssh_exec":
+        lines.append("127.0.0.1:{0},bench,bench  #@ssh_mode=exec\n".format(port))
+    else:
+        lines.append("127.0.0.1:{0},bench,bench\n".format(port))
+    for i in range(commands):
+        lines.append("show bench {0}\n".format(i))
+    lines.append("exit\n")
+    return lines
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile.
+    """
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0), len(values) - 1)]
+
+def peak_rss_kb() -> int:
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes on macOS.
+        maxrss //= 1024
+    return maxrss
+
+def run_scenario(scenario: str, port: int, sessions: int, commands: int, event_queue: multiprocessing.Queue, logdir_path: str) -> Dict[str, object]:
+    """
+    Execute the sessions of the scenario, and summarize the device side records.
+    """
+    oi = pyTelnetCmdExec.OutputInformation(False, logdir_path, "")
+    plan = pyTelnetCmdExec.parse_cmdlist(scenario, create_cmdlist(scenario, port, commands))
+
+    errors = 0
+    wall_time = 0.0
+    cpu_start = time.process_time()
+    for _ in range(sessions):
+        cn = plan.connection_information(timeout=2)
+        start_time = time.time()
+        try:
+            if scenario in ("telnet", "telnet_paging"):
+                pyTelnetCmdExec.cmdlist_exec_telnet(plan.commands, cn, pyTelnetCmdExec.standby_prompts, oi)
+            elif scenario == "ssh_exec":
+                pyTelnetCmdExec.cmdlist_exec_ssh_exec(plan.commands, cn, oi)
+            else:
+                pyTelnetCmdExec.cmdlist_exec_ssh(plan.commands, cn, pyTelnetCmdExec.standby_prompts, oi)
+        except (SystemExit, Exception):
+            errors += 1
+        wall_time += time.time() - start_time
+    cpu_time = time.process_time() - cpu_start
+
+    latencies = []
+    bench_commands = 0
+    bytes_sent = 0
+    for _ in range(sessions - errors):
+        try:
+            record = event_queue.get(timeout=10)
+        except Exception:
+            break
+        bytes_sent += record["bytes_sent"]
+        arrivals = record["arrivals"]
+        for (cmd, t0), (_, t1) in zip(arrivals, arrivals[1:]):
+            if cmd.startswith("show bench"):
+                bench_commands += 1
+                latencies.append(t1 - t0)
+
+    return {
+        "sessions": sessions,
+        "errors": errors,
+        "commands": bench_commands,
+        "bytes": bytes_sent,
+        "wall_time": wall_time,
+        "commands_per_sec": bench_commands / wall_time if wall_time > 0 else 0.0,
+        "bytes_per_sec": bytes_sent / wall_time if wall_time > 0 else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "cpu_time": cpu_time,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+def compare_baseline(results: Dict[str, Dict[str, object]], baseline: Dict[str, object], tolerance: float) -> bool:
+    """
+    Print the comparison with the baseline, and return False on regression.
+    """
+    success = True
+    for scenario, result in results.items():
+        base = baseline.get("results", {}).get(scenario)
+        if base is None:
+            continue
+        for key, higher_is_better in (("commands_per_sec", True), ("bytes_per_sec", True), ("latency_p99", False), ("cpu_time", False)):
+            if base[key] <= 0:
+                continue
+            ratio = result[key] / base[key]
+            regression = ratio < 1.0 - tolerance if higher_is_better else ratio > 1.0 + tolerance
+            print("{0:<13} {1:<18} {2:>12.4f} {3:>12.4f} {4:>7.2f}x {5}".format(scenario, key, base[key], result[key], ratio, "REGRESSION" if regression else ""))
+            if regression:
+                success = False
+    return success
+
+def main():
+    args = docopt.docopt(__doc__)
+
+    scenarios = ["telnet", "telnet_paging", "ssh", "ssh_exec"]
+    if args["--scenario"] and args["--scenario"] != "all":
+        if args["--scenario"] not in scenarios:
+            print("unknown scenario {0}".format(args["--scenario"]))
+            exit(1)
+        scenarios = [args["--scenario"]]
+
+    parameters = {
+        "sessions": int(args["--sessions"] or 5),
+        "commands": int(args["--commands"] or 20),
+        "lines": int(args["--lines"] or 100),
+        "line_size": int(args["--line_size"] or 80),
+        "page_lines": int(args["--page_lines"] or 24),
+        "delay": float(args["--delay"] or 0),
+    }
+    tolerance = float(args["--tolerance"] or 0.2)
+
+    config = DeviceConfig(parameters["lines"], parameters["line_size"], parameters["page_lines"], parameters["delay"])
+    port_queue = multiprocessing.Queue()
+    event_queue = multiprocessing.Queue()
+    devices = multiprocessing.Process(target=run_devices, args=(config, port_queue, event_queue), daemon=True)
+    devices.start()
+    ports = port_queue.get(timeout=30)
+
+    # Do not echo the output of sessions.
+    pyTelnetCmdExec.echo_console = False
+    logdir_path = tempfile.mkdtemp(prefix="pyTelnetCmdExec_bench_")
+
+    results = {}
+    try:
+        for scenario in scenarios:
+            results[scenario] = run_scenario(scenario, ports[scenario], parameters["sessions"], parameters["commands"], event_queue, logdir_path)
+    finally:
+        devices.terminate()
+        shutil.rmtree(logdir_path, ignore_errors=True)
+
+    print("{0:<13} {1:>10} {2:>12} {3:>10} {4:>10} {5:>8} {6:>10} {7:>6}".format("scenario", "cmd/s", "bytes/s", "p50(ms)", "p99(ms)", "cpu(s)", "rss(KiB)", "errors"))
+    for scenario, result in results.items():
+        print("{0:<13} {1:>10.1f} {2:>12.0f} {3:>10.2f} {4:>10.2f} {5:>8.2f} {6:>10} {7:>6}".format(
+            scenario, result["commands_per_sec"], result["bytes_per_sec"], result["latency_p50"] * 1000, result["latency_p99"] * 1000,
+            result["cpu_time"], str(result["peak_rss_kb"]), result["errors"]))
+
+    report = {
+        "version": 1,
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "results": results,
+    }
+    if args["--output"]:
+        with open(args["--output"], "wt", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args["--baseline"]:
+        with open(args["--baseline"], "rt", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare_baseline(results, baseline, tolerance):
+            exit(1)
+
+    for result in results.values():
+        if result["errors"] > 0:
+            exit(1)
+
+if __name__ == '__main__':
+    main()